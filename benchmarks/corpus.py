@@ -0,0 +1,106 @@
+import json
+import subprocess as sp
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# name: (files, hours, tracks of the json mode config)
+PRESETS = {
+    "tiny": (10, 1, 1),
+    "small": (100, 5, 5),
+    "medium": (500, 10, 10),
+    "large": (2000, 30, 20),
+    "huge": (5000, 50, 50),
+}
+CODECS = {".mp3": "libmp3lame", ".m4a": "aac"}
+SAMPLE_RATE = 44100
+MARKER = "corpus.json"
+
+
+def _generate_file(file: Path, seconds: float, frequency: int, bitrate: str) -> None:
+    # a sine tone under pink noise: cheap to generate, but not trivially compressible
+    cmd = [
+        "ffmpeg", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i",
+        f"sine=frequency={frequency}:sample_rate={SAMPLE_RATE}:duration={seconds}",
+        "-f", "lavfi", "-i",
+        f"anoisesrc=color=pink:amplitude=0.05:sample_rate={SAMPLE_RATE}"
+        f":duration={seconds}",
+        "-filter_complex", "amix=inputs=2:duration=shortest", "-ac", "1",
+        "-c:a", CODECS[file.suffix], "-b:a", bitrate, file,
+    ]  # fmt: skip
+    sp.run(cmd, check=True)
+
+
+def _generate_cover(file: Path) -> None:
+    cmd = [
+        "ffmpeg", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", "color=c=steelblue:s=600x600", "-frames:v", "1", file,
+    ]  # fmt: skip
+    sp.run(cmd, check=True)
+
+
+def generate_corpus(
+    root: Path,
+    preset: str,
+    input_type: str = ".mp3",
+    bitrate: str = "64k",
+    workers: int = 4,
+) -> Path:
+    """Generates (or reuses) a synthetic book and returns the path of its config.
+
+    The corpus is deterministic for a given preset, input type and bitrate, so it is
+    only generated once per work directory.
+    """
+    files, hours, tracks = PRESETS[preset]
+    params = {
+        "preset": preset,
+        "files": files,
+        "hours": hours,
+        "input_type": input_type,
+        "bitrate": bitrate,
+    }
+    book_path = Path(root) / f"{preset}-{input_type.lstrip('.')}-{bitrate}"
+    marker = book_path / MARKER
+    if marker.is_file() and json.loads(marker.read_text())["params"] == params:
+        return marker
+
+    book_path.mkdir(parents=True, exist_ok=True)
+    seconds = hours * 3600 / files
+    names = [f"{i + 1:05d}{input_type}" for i in range(files)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(
+            executor.map(
+                lambda item: _generate_file(
+                    book_path / item[1], seconds, 220 + item[0] % 40 * 10, bitrate
+                ),
+                enumerate(names),
+            )
+        )
+    _generate_cover(book_path / "cover.jpg")
+
+    per_track = -(-files // tracks)
+    config = {
+        "path": str(book_path),
+        "title": f"Benchmark {preset}",
+        "author": "m4bmaker",
+        "narrator": "lavfi",
+        "genre": "Audiobook",
+        "disc": "1",
+        "total_discs": "1",
+        "year": "2025",
+        "cover": "cover.jpg",
+        "tracks": [
+            {
+                "title": f"Track {tr + 1}",
+                "file": f"{tr + 1:03d} Track {tr + 1}.m4b",
+                "chapters": [
+                    {"title": f"Chapter {ch + 1}", "files": [name]}
+                    for ch, name in enumerate(names[start : start + per_track])
+                ],
+            }
+            for tr, start in enumerate(range(0, files, per_track))
+        ],
+        "params": params,
+    }
+    marker.write_text(json.dumps(config, indent=2))
+    return marker
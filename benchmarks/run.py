@@ -0,0 +1,185 @@
+"""Times the stages of m4bmaker on synthetic corpora and compares them to a baseline.
+
+    python -m benchmarks.run --presets tiny small --modes json single \
+        --output results.json --baseline benchmarks/baseline.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess as sp
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from benchmarks.corpus import PRESETS, generate_corpus
+from m4bmaker import M4BMaker
+
+STAGES = ["load", "plan", "probe", "temp_files", "concat", "encode", "total"]
+
+
+# report stages of M4BMaker that are summed up into the stages of the benchmark
+REPORT_STAGES = {
+    "plan": ["plan"],
+    "probe": ["probe"],
+    "temp_files": ["temp_files"],
+    "concat": ["concat"],
+    "encode": ["encode", "remux", "retag", "segment", "join"],
+}
+
+
+def run_case(config: Path, work_dir: Path, case: dict) -> tuple[dict, dict]:
+    """Returns the seconds spent per stage and the book totals of the run report."""
+    start = time.perf_counter()
+    maker = M4BMaker(
+        json_path=config,
+        mode=case["mode"],
+        output_bitrate=case["output_bitrate"],
+        log_path=work_dir / "benchmark.log",
+        jobs=case["jobs"],
+        pipeline=case["pipeline"],
+        probe_cache=case["probe_cache"],
+        cache_dir=work_dir / "cache",
+    )
+    load = time.perf_counter() - start
+    shutil.rmtree(maker.output_path, ignore_errors=True)  # no up-to-date tracks
+    maker.convert()
+    total = time.perf_counter() - start
+    shutil.rmtree(maker.output_path, ignore_errors=True)
+
+    report = maker.report.to_dict()
+    times = {
+        stage: sum(report["stages"].get(name, {}).get("wall", 0) for name in names)
+        for stage, names in REPORT_STAGES.items()
+    }
+    times |= {"load": load, "total": total}
+    return {stage: round(times[stage], 4) for stage in STAGES}, report["book"]
+
+
+def ffmpeg_version() -> str:
+    result = sp.run(["ffmpeg", "-version"], capture_output=True, text=True)
+    return result.stdout.splitlines()[0] if result.stdout else ""
+
+
+def compare(results: dict, baseline: dict, tolerance: float, floor: float) -> list:
+    """Returns (case, stage, baseline, current) of every stage slower than allowed.
+
+    Stages under `floor` seconds in the baseline are too noisy to compare.
+    """
+    regressions = []
+    for key, result in results["cases"].items():
+        base = baseline.get("cases", {}).get(key)
+        if not base:
+            continue
+        for stage in STAGES:
+            before, after = base["stages"].get(stage), result["stages"].get(stage)
+            if before is None or after is None or before < floor:
+                continue
+            if after > before * (1 + tolerance):
+                regressions.append((key, stage, before, after))
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="m4bmaker benchmarks.")
+    parser.add_argument("--presets", nargs="+", choices=PRESETS, default=["tiny"])
+    parser.add_argument("--input-types", nargs="+", choices=[".mp3", ".m4a"],
+                        default=[".mp3"])  # fmt: skip
+    parser.add_argument("--input-bitrate", default="64k")
+    parser.add_argument("--modes", nargs="+", choices=["json", "single", "chapter"],
+                        default=["json"])  # fmt: skip
+    parser.add_argument("--output-bitrates", nargs="+", default=["64k"])
+    parser.add_argument("--pipelines", nargs="+", choices=["single_pass", "two_pass"],
+                        default=["single_pass", "two_pass"])  # fmt: skip
+    parser.add_argument("--jobs", nargs="+", type=int, default=[1])
+    parser.add_argument(
+        "--warm-probe-cache",
+        action="store_true",
+        help="Keep the probe cache between runs instead of probing every file.",
+    )
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Runs per case, the fastest one is kept.")  # fmt: skip
+    parser.add_argument("--work-dir", type=Path, default=Path("bench_work"))
+    parser.add_argument("--output", type=Path, default=Path("bench_results.json"))
+    parser.add_argument("--baseline", type=Path, default=None)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Write the results to --baseline instead of comparing against it.",
+    )
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed slowdown per stage (default: 0.2).")  # fmt: skip
+    parser.add_argument(
+        "--floor",
+        type=float,
+        default=0.05,
+        help="Don't compare stages faster than this in the baseline (default: 0.05s).",
+    )
+    args = parser.parse_args()
+
+    work_dir = args.work_dir.resolve()
+    work_dir.mkdir(parents=True, exist_ok=True)
+    results = {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "ffmpeg": ffmpeg_version(),
+        },
+        "cases": {},
+    }
+    for preset, input_type in itertools.product(args.presets, args.input_types):
+        print(f"Generating corpus {preset} ({input_type})...", file=sys.stderr)
+        config = generate_corpus(
+            work_dir / "corpora", preset, input_type, args.input_bitrate
+        )
+        for mode, bitrate, pipeline, jobs in itertools.product(
+            args.modes, args.output_bitrates, args.pipelines, args.jobs
+        ):
+            case = {
+                "preset": preset,
+                "files": PRESETS[preset][0],
+                "hours": PRESETS[preset][1],
+                "input_type": input_type,
+                "mode": mode,
+                "output_bitrate": bitrate,
+                "pipeline": pipeline,
+                "jobs": jobs,
+                "probe_cache": args.warm_probe_cache,
+            }
+            key = "/".join(
+                str(case[k])
+                for k in ("preset", "input_type", "mode", "output_bitrate",
+                          "pipeline", "jobs")  # fmt: skip
+            )
+            runs = [run_case(config, work_dir, case) for _ in range(args.repeat)]
+            stages = {stage: min(run[stage] for run, _ in runs) for stage in STAGES}
+            book = min((book for _, book in runs), key=lambda book: book["wall"])
+            results["cases"][key] = {"params": case, "stages": stages, "book": book}
+            print(f"{key}: {stages}", file=sys.stderr)
+
+    args.output.write_text(json.dumps(results, indent=2))
+    print(f"Results written to {args.output}", file=sys.stderr)
+    if not args.baseline:
+        return
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2))
+        print(f"Baseline written to {args.baseline}", file=sys.stderr)
+        return
+
+    baseline = json.loads(args.baseline.read_text())
+    regressions = compare(results, baseline, args.tolerance, args.floor)
+    for key, stage, before, after in regressions:
+        print(f"REGRESSION {key} {stage}: {before:.3f}s -> {after:.3f}s")
+    if regressions:
+        sys.exit(1)
+    print("No regressions against the baseline.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
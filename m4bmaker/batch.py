@@ -0,0 +1,152 @@
+import glob
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from m4bmaker.logger import close_logger, logger_factory
+from m4bmaker.m4bmaker import M4BMaker
+
+CONFIG_NAME = "m4bmaker.json"
+
+
+def find_configs(inputs: list[str], config_name: str = CONFIG_NAME) -> list[Path]:
+    """Resolves the configs of a batch, without duplicates and in input order.
+
+    Every input is a glob pattern, a directory tree searched for config_name files,
+    a .json config or a list file with one of these per line ("#" for comments).
+    """
+    configs = []
+    for item in inputs:
+        if glob.has_magic(item):
+            configs += sorted(Path(p) for p in glob.glob(item, recursive=True))
+        elif (path := Path(item)).is_dir():
+            configs += sorted(path.rglob(config_name))
+        elif path.suffix.lower() == ".json":
+            configs.append(path)
+        else:  # list file, relative entries are relative to it
+            with open(path, "r", encoding="utf-8") as f:
+                lines = [line.strip() for line in f]
+            configs += find_configs(
+                [
+                    str(path.parent / line)
+                    for line in lines
+                    if line and not line.startswith("#")
+                ],
+                config_name,
+            )
+    return list(dict.fromkeys(config.resolve() for config in configs))
+
+
+def convert_book(config: Path, log_path: Path, log_name: str, **options) -> dict:
+    """Converts one book of many, returning its outcome instead of raising.
+
+    The book logs to its own logger & file, which are closed afterwards.
+    """
+    result = {"config": str(config), "log": str(log_path), "ok": False}
+    start = time.monotonic()
+    m4b = None
+    try:
+        m4b = M4BMaker(
+            json_path=config, log_path=log_path, log_name=log_name, **options
+        )
+        m4b.convert()
+        result["ok"] = True
+    except Exception as exc:
+        result["error"] = str(exc)
+    finally:
+        result["wall"] = round(time.monotonic() - start, 3)
+        result["audio_seconds"] = 0
+        if m4b:
+            book = m4b.report.to_dict()["book"]
+            result["audio_seconds"] = book["audio_seconds"]
+            result["realtime_factor"] = book["realtime_factor"]
+        close_logger(logging.getLogger(log_name))
+    return result
+
+
+class Batch:
+    """Converts many books with one shared limit on concurrent ff processes.
+
+    Every ffmpeg/ffprobe run of every book takes one of `slots`, so the machine stays
+    busy without being oversubscribed. Up to `books` books are in flight at once, and
+    each of them runs at most `jobs` tracks and `probe_workers` ffprobes at once (the
+    per-book cap). Each book logs to its own file in log_dir.
+    """
+
+    def __init__(
+        self,
+        configs: list[Path],
+        log_dir: Path,
+        slots: int | None = None,
+        books: int | None = None,
+        jobs: int = 1,
+        probe_workers: int | None = None,
+        **options,
+    ) -> None:
+        self.configs = configs
+        self.log_dir = Path(log_dir)
+        self.slots = slots or os.cpu_count() or 1
+        self.jobs = jobs
+        self.probe_workers = probe_workers or jobs
+        # enough books in flight to fill every slot, plus one to cover the gaps
+        self.books = books or self.slots // max(self.jobs, self.probe_workers) + 1
+        self.options = options
+        self._semaphore = threading.BoundedSemaphore(self.slots)
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.lg = logger_factory(
+            name=f"{__name__}.summary", log_path=self.log_dir / "batch.log"
+        )
+
+    def _log_name(self, i: int, config: Path) -> str:
+        name = re.sub(r"[^\w.-]+", "_", config.parent.name or config.stem)
+        return f"{i + 1:04d}-{name}"
+
+    def _convert(self, item: tuple[int, Path]) -> dict:
+        i, config = item
+        log_name = self._log_name(i, config)
+        self.lg.info(f"Starting book {i + 1}/{len(self.configs)}: {config}")
+        result = convert_book(
+            config,
+            self.log_dir / f"{log_name}.log",
+            f"{__name__}.{log_name}",
+            slots=self._semaphore,
+            jobs=self.jobs,
+            probe_workers=self.probe_workers,
+            **self.options,
+        )
+        if not result["ok"]:
+            self.lg.error(f"Book failed: {config}: {result['error']}")
+        self.lg.info(f"Finished book {i + 1}/{len(self.configs)}: {result}")
+        return result
+
+    def run(self) -> dict:
+        """Converts every book and returns a summary of the batch."""
+        self.lg.info(
+            f"Converting {len(self.configs)} book(s): {self.slots} slot(s), "
+            f"{self.books} book(s) at once, {self.jobs} job(s) per book."
+        )
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.books) as pool:
+            results = list(pool.map(self._convert, enumerate(self.configs)))
+        wall = time.monotonic() - start
+        audio_seconds = sum(result["audio_seconds"] for result in results)
+        summary = {
+            "books": len(results),
+            "succeeded": sum(result["ok"] for result in results),
+            "failed": sum(not result["ok"] for result in results),
+            "slots": self.slots,
+            "wall": round(wall, 3),
+            "audio_seconds": round(audio_seconds, 3),
+            "realtime_factor": round(audio_seconds / wall, 2) if wall else None,
+            "books_per_hour": round(len(results) * 3600 / wall, 2) if wall else None,
+            "results": results,
+        }
+        self.lg.info(
+            f"Batch done: {summary['succeeded']} succeeded, {summary['failed']} failed "
+            f"in {summary['wall']}s, {summary['realtime_factor']}x realtime."
+        )
+        return summary
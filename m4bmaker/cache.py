@@ -0,0 +1,234 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from m4bmaker.types import MediaInfo
+
+
+def default_cache_dir() -> Path:
+    """Returns the per-user cache directory of m4bmaker."""
+    base = os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME")
+    return Path(base or Path.home() / ".cache") / "m4bmaker"
+
+
+def file_identity(file: Path) -> tuple[str, int, int, int]:
+    """Returns (resolved path, size, mtime_ns, inode) of a file."""
+    stat = file.stat()
+    return str(file.resolve()), stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+class ProbeCache:
+    """Persistent cache of probed media info, keyed by file identity.
+
+    Entries are invalidated when the size, mtime or inode of a file changes, and the
+    least recently used entries are evicted once the cache holds max_entries.
+    """
+
+    # version of the probed fields, entries of other versions are dropped on open
+    VERSION = 3
+
+    def __init__(self, cache_dir: Path, max_entries: int = 100_000) -> None:
+        self.path = Path(cache_dir) / "probe_cache.sqlite"
+        self.max_entries = max_entries
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS probes (path TEXT PRIMARY KEY, size INT, "
+                "mtime_ns INT, inode INT, info TEXT, last_used REAL)"
+            )
+            version = self._db.execute("PRAGMA user_version").fetchone()[0]
+            if version != self.VERSION:
+                self._db.execute("DELETE FROM probes")
+                self._db.execute(f"PRAGMA user_version = {self.VERSION}")
+
+    def __enter__(self) -> "ProbeCache":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def get_many(self, files: list[Path]) -> dict[Path, MediaInfo]:
+        """Returns the cached media info of the files whose identity is unchanged."""
+        hits = {}
+        with self._lock, self._db:
+            for file in files:
+                path, size, mtime_ns, inode = file_identity(file)
+                row = self._db.execute(
+                    "SELECT info FROM probes WHERE path = ? AND size = ? "
+                    "AND mtime_ns = ? AND inode = ?",
+                    (path, size, mtime_ns, inode),
+                ).fetchone()
+                if row:
+                    hits[file] = json.loads(row[0])
+            self._db.executemany(
+                "UPDATE probes SET last_used = ? WHERE path = ?",
+                [(time.time(), str(file.resolve())) for file in hits],
+            )
+        return hits
+
+    def put_many(self, media_info: dict[Path, MediaInfo]) -> None:
+        """Stores media info, then evicts the least recently used entries."""
+        now = time.time()
+        rows = [
+            (*file_identity(file), json.dumps(info), now)
+            for file, info in media_info.items()
+        ]
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+            self._db.execute(
+                "DELETE FROM probes WHERE path IN (SELECT path FROM probes "
+                "ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM probes").fetchone()[0]
+        return {
+            "path": str(self.path),
+            "entries": entries,
+            "max_entries": self.max_entries,
+        }
+
+    def clear(self) -> None:
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM probes")
+
+
+class EncodeCache:
+    """Content-addressed store of encoded audio segments.
+
+    Segments are stored under their key, which the caller derives from the content
+    hashes of the input files and the encoder settings. prune() evicts the least
+    recently used segments until the cache fits into max_size bytes.
+    """
+
+    SUFFIX = ".m4a"
+
+    def __init__(self, cache_dir: Path, max_size: int = 20 * 1024**3) -> None:
+        self.dir = Path(cache_dir) / "encode"
+        self.path = Path(cache_dir) / "encode_cache.sqlite"
+        self.max_size = max_size
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS segments (key TEXT PRIMARY KEY, size INT, "
+                "last_used REAL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS hashes (path TEXT PRIMARY KEY, size INT, "
+                "mtime_ns INT, inode INT, sha256 TEXT)"
+            )
+
+    def __enter__(self) -> "EncodeCache":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _file(self, key: str) -> Path:
+        return self.dir / key[:2] / f"{key}{self.SUFFIX}"
+
+    def content_hash(self, file: Path) -> str:
+        """Returns the sha256 of a file, hashing it only when its identity changed."""
+        path, size, mtime_ns, inode = identity = file_identity(file)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT sha256 FROM hashes WHERE path = ? AND size = ? "
+                "AND mtime_ns = ? AND inode = ?",
+                identity,
+            ).fetchone()
+        if row:
+            return row[0]
+        with open(file, "rb") as f:
+            digest = hashlib.file_digest(f, "sha256").hexdigest()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)",
+                (path, size, mtime_ns, inode, digest),
+            )
+        return digest
+
+    @staticmethod
+    def key(content_hashes: list[str], settings: dict) -> str:
+        """Derives the key of a segment from its inputs and encoder settings."""
+        data = json.dumps({"inputs": content_hashes, **settings}, sort_keys=True)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Path | None:
+        file = self._file(key)
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT size FROM segments WHERE key = ?", (key,)
+            ).fetchone()
+            if not row or not file.is_file() or file.stat().st_size != row[0]:
+                return None
+            self._db.execute(
+                "UPDATE segments SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+        return file
+
+    def put(self, key: str, segment: Path) -> Path:
+        """Moves an encoded segment into the cache and returns its new path."""
+        file = self._file(key)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        shutil.move(segment, file)  # copies when the scratch dir is another volume
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO segments VALUES (?, ?, ?)",
+                (key, file.stat().st_size, time.time()),
+            )
+        return file
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM segments"
+            ).fetchone()
+        return {
+            "path": str(self.dir),
+            "entries": entries,
+            "size": size,
+            "max_size": self.max_size,
+        }
+
+    def prune(self, max_size: int | None = None) -> dict:
+        """Drops missing segments and evicts the least recently used ones."""
+        max_size = self.max_size if max_size is None else max_size
+        removed = freed = 0
+        with self._lock, self._db:
+            rows = self._db.execute(
+                "SELECT key, size FROM segments ORDER BY last_used DESC"
+            ).fetchall()
+            total, full = 0, False
+            for key, size in rows:
+                file = self._file(key)
+                full = full or total + size > max_size
+                if file.is_file() and not full:
+                    total += size
+                    continue
+                if file.is_file():
+                    file.unlink()
+                    freed += size
+                self._db.execute("DELETE FROM segments WHERE key = ?", (key,))
+                removed += 1
+        return {"removed": removed, "freed": freed, "size": total}
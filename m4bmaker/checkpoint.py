@@ -0,0 +1,73 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+
+class CheckpointJournal:
+    """Append-only journal of the completed ff runs of a book, to resume after a crash.
+
+    Every line holds the key of a run, derived from its command and inputs, and the
+    size & mtime of its output. Lines are fsynced as they are written, and a line cut
+    short by a crash is ignored. A run counts as done only while its output is still
+    exactly the file that was journaled.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._entries: dict[str, dict] = {}
+
+    def load(self) -> int:
+        """Reads the journal of an earlier run, returns the number of entries."""
+        with self._lock:
+            self._entries.clear()
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:  # torn write
+                            continue
+                        self._entries[entry["key"]] = entry
+            except FileNotFoundError:
+                pass
+            return len(self._entries)
+
+    def discard(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.path.unlink(missing_ok=True)
+
+    @staticmethod
+    def _identity(file: Path) -> dict | None:
+        try:
+            stat = os.stat(file)
+        except OSError:
+            return None
+        return {"file": str(file), "size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+    def is_done(self, key: str, file: Path) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+        return bool(entry) and {"key": key, **(self._identity(file) or {})} == entry
+
+    def files(self) -> set[Path]:
+        """Outputs of the journaled runs that are still intact."""
+        with self._lock:
+            entries = list(self._entries.values())
+        return {
+            Path(entry["file"])
+            for entry in entries
+            if self.is_done(entry["key"], Path(entry["file"]))
+        }
+
+    def record(self, key: str, file: Path) -> None:
+        entry = {"key": key, **self._identity(file)}
+        with self._lock:
+            self._entries[key] = entry
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
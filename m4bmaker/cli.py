@@ -1,8 +1,14 @@
 import argparse
 import json
+import signal
+import sys
 from pathlib import Path
 
 from m4bmaker import M4BMaker
+from m4bmaker.batch import Batch, find_configs
+from m4bmaker.cache import EncodeCache, ProbeCache, default_cache_dir
+from m4bmaker.progress import print_progress
+from m4bmaker.watch import Watcher
 
 
 def cli() -> None:
@@ -31,32 +37,371 @@ def cli() -> None:
         default="64k",
         help="Output audio bitrate: '64k' or '128k' (default: '64k').",
     )
+    parser.add_argument(
+        "--pipeline",
+        type=str,
+        choices=["single_pass", "two_pass"],
+        default="two_pass",
+        help="'single_pass' encodes each track in one ffmpeg run, 'two_pass' goes "
+        "through an intermediate mp3 (default: 'two_pass').",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        choices=["default", "streaming", "fragmented"],
+        default="default",
+        help="'streaming' writes the moov before the audio so players can start "
+        "without seeking to the end, 'fragmented' writes fragmented MP4 "
+        "(default: 'default').",
+    )
+    parser.add_argument(
+        "--fragment-duration",
+        type=float,
+        default=10.0,
+        help="Duration of the fragments of the 'fragmented' profile in seconds "
+        "(default: 10).",
+    )
+    parser.add_argument(
+        "--hls",
+        action="store_true",
+        help="Also cut every track into HLS fMP4 segments aligned with its chapters, "
+        "by stream copy, with a playlist and a chapters.json.",
+    )
+    parser.add_argument(
+        "--hls-segment-duration",
+        type=float,
+        default=6.0,
+        help="Target duration of the HLS segments in seconds (default: 6).",
+    )
+    parser.add_argument(
+        "--seek-index",
+        action="store_true",
+        help="Write a .seek.json next to every output after converting, mapping "
+        "chapters and a time grid to byte offsets for range requests.",
+    )
+    parser.add_argument(
+        "--seek-grid",
+        type=float,
+        default=30.0,
+        help="Seconds between the grid points of the seek index (default: 30).",
+    )
+    parser.add_argument(
+        "--no-passthrough",
+        action="store_true",
+        help="Always re-encode, even when a track's only input is already AAC "
+        "within the output bitrate.",
+    )
+    parser.add_argument(
+        "--no-segment-parallel",
+        action="store_true",
+        help="Don't split tracks into chapter segments that are encoded in parallel "
+        "when there are more jobs than tracks.",
+    )
+    parser.add_argument(
+        "--progress",
+        action="store_true",
+        help="Show a live progress line while converting.",
+    )
+    parser.add_argument(
+        "--report",
+        type=Path,
+        default=None,
+        help="Write a JSON report of the time, cpu and memory spent per track and "
+        "stage to this path after converting.",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=Path,
+        default=None,
+        help="Directory of the converted books, each in a folder named after its "
+        "title (default: an 'output' folder inside each book).",
+    )
+    parser.add_argument(
+        "--scratch-dir",
+        type=Path,
+        default=None,
+        help="Directory of the intermediate files, e.g. on a fast local disk or "
+        "tmpfs, each book in its own folder (default: next to the output files).",
+    )
+    parser.add_argument(
+        "--keep-temp",
+        action="store_true",
+        help="Keep the intermediate files for debugging, they are left to the "
+        "orphan sweep of later runs.",
+    )
+    parser.add_argument(
+        "--temp-ttl",
+        type=float,
+        default=24,
+        help="Hours after which the intermediate files of crashed runs are swept "
+        "(default: 24).",
+    )
     parser.add_argument(
         "--log-path",
         type=Path,
         default=Path.cwd() / "m4bmaker.log",
         help="Path to the log file (default: ./m4bmaker.log).",
     )
+    parser.add_argument(
+        "--probe-workers",
+        type=int,
+        default=None,
+        help="Number of parallel ffprobe workers (default: number of CPU cores).",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of tracks to convert concurrently (default: 1).",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=None,
+        help="Directory of the persistent caches (default: per-user cache directory).",
+    )
+    parser.add_argument(
+        "--encode-cache",
+        action="store_true",
+        help="Reuse encoded chapters from the persistent encode cache.",
+    )
+    parser.add_argument(
+        "--encode-cache-size",
+        type=float,
+        default=20,
+        help="Size limit of the encode cache in GiB (default: 20).",
+    )
+    parser.add_argument(
+        "--no-probe-cache",
+        action="store_true",
+        help="Don't read or write the persistent probe cache.",
+    )
+    parser.add_argument(
+        "--rebuild-probe-cache",
+        action="store_true",
+        help="Clear the persistent probe cache and probe all files again.",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Check the structure, duration, chapters and tags of the outputs after "
+        "converting, and fail if any doesn't match.",
+    )
 
     subparsers = parser.add_subparsers(dest="subparser_name")
     subparsers.add_parser("to_dict", help="Shows the audiobook data as a dictionary.")
-    subparsers.add_parser("convert", help="Converts the audiobook to .m4b format.")
+    convert_parser = subparsers.add_parser(
+        "convert", help="Converts the audiobook to .m4b format."
+    )
+    convert_parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted conversion from its last completed ffmpeg run, "
+        "and keep the completed intermediates if this one fails too.",
+    )
+    verify_parser = subparsers.add_parser(
+        "verify", help="Checks the converted .m4b files against the audiobook data."
+    )
+    verify_parser.add_argument(
+        "--deep",
+        action="store_true",
+        help="Also decode a few samples of every file with ffmpeg.",
+    )
+    subparsers.add_parser(
+        "index", help="Writes the seek index of the converted .m4b files."
+    )
+    batch_parser = subparsers.add_parser(
+        "batch",
+        help="Converts many audiobooks with one shared pool of ffmpeg processes.",
+    )
+    batch_parser.add_argument(
+        "inputs",
+        nargs="+",
+        help="Config files: glob patterns, directory trees searched for "
+        "m4bmaker.json files, .json files or list files with one of these per line.",
+    )
+    batch_parser.add_argument(
+        "--slots",
+        type=int,
+        default=None,
+        help="Number of ffmpeg/ffprobe processes across all books (default: number "
+        "of CPU cores). --jobs and --probe-workers cap each book.",
+    )
+    batch_parser.add_argument(
+        "--books",
+        type=int,
+        default=None,
+        help="Number of books converted at once (default: enough to fill the slots).",
+    )
+    batch_parser.add_argument(
+        "--log-dir",
+        type=Path,
+        default=Path.cwd() / "m4bmaker_logs",
+        help="Directory of the per-book log files (default: ./m4bmaker_logs).",
+    )
+    batch_parser.add_argument(
+        "--summary",
+        type=Path,
+        default=None,
+        help="Also write the JSON summary of the batch to this path.",
+    )
+    watch_parser = subparsers.add_parser(
+        "watch",
+        help="Converts every book folder dropped into a directory, until stopped.",
+    )
+    watch_parser.add_argument("root", type=Path, help="Directory to watch.")
+    watch_parser.add_argument(
+        "--interval",
+        type=float,
+        default=5.0,
+        help="Seconds between scans of the directory (default: 5).",
+    )
+    watch_parser.add_argument(
+        "--settle",
+        type=float,
+        default=30.0,
+        help="Seconds a book folder must be unchanged before it's converted "
+        "(default: 30).",
+    )
+    watch_parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of books converted at once (default: 1).",
+    )
+    watch_parser.add_argument(
+        "--slots",
+        type=int,
+        default=None,
+        help="Number of ffmpeg/ffprobe processes across all books (default: number "
+        "of CPU cores).",
+    )
+    watch_parser.add_argument(
+        "--log-dir",
+        type=Path,
+        default=Path.cwd() / "m4bmaker_logs",
+        help="Directory of the watch log and the per-book logs "
+        "(default: ./m4bmaker_logs).",
+    )
+    watch_parser.add_argument(
+        "--once",
+        action="store_true",
+        help="Convert the settled book folders once and exit, e.g. from cron.",
+    )
+    cache_parser = subparsers.add_parser("cache", help="Manages the persistent caches.")
+    cache_parser.add_argument(
+        "action",
+        choices=["stats", "prune"],
+        help="'stats' shows the cache sizes, 'prune' evicts encoded chapters "
+        "beyond --encode-cache-size.",
+    )
 
     args = parser.parse_args()
     try:
         if args.subparser_name is None:
             parser.print_help()
             return
+        encode_cache_size = int(args.encode_cache_size * 1024**3)
+        if args.subparser_name == "cache":
+            cache_dir = args.cache_dir or default_cache_dir()
+            with ProbeCache(cache_dir) as probes:
+                with EncodeCache(cache_dir, encode_cache_size) as encodes:
+                    if args.action == "prune":
+                        print(json.dumps(encodes.prune(), indent=2))
+                    else:
+                        stats = {"probe": probes.stats(), "encode": encodes.stats()}
+                        print(json.dumps(stats, indent=2))
+            return
+
+        options = {
+            "mode": args.mode,
+            "output_bitrate": args.output_bitrate,
+            "pipeline": args.pipeline,
+            "profile": args.profile,
+            "fragment_duration": args.fragment_duration,
+            "hls": args.hls,
+            "hls_segment_duration": args.hls_segment_duration,
+            "passthrough": not args.no_passthrough,
+            "segment_parallel": not args.no_segment_parallel,
+            "probe_workers": args.probe_workers,
+            "jobs": args.jobs,
+            "probe_cache": not args.no_probe_cache,
+            "cache_dir": args.cache_dir,
+            "encode_cache": args.encode_cache,
+            "encode_cache_size": encode_cache_size,
+            "output_dir": args.output_dir,
+            "scratch_dir": args.scratch_dir,
+            "keep_temp": args.keep_temp,
+            "temp_ttl": args.temp_ttl * 3600,
+            "verify_output": args.verify,
+            "seek_index": args.seek_index,
+            "seek_grid": args.seek_grid,
+        }
+        if args.subparser_name == "batch":
+            if args.rebuild_probe_cache:  # once, not for every book
+                with ProbeCache(args.cache_dir or default_cache_dir()) as probes:
+                    probes.clear()
+            batch = Batch(
+                find_configs(args.inputs),
+                args.log_dir,
+                slots=args.slots,
+                books=args.books,
+                **options,
+            )
+            summary = batch.run()
+            print(json.dumps(summary, indent=2))
+            if args.summary:
+                args.summary.write_text(
+                    json.dumps(summary, indent=2), encoding="utf-8"
+                )
+            if summary["failed"]:
+                sys.exit(1)
+            return
+
+        if args.subparser_name == "watch":
+            # folders without an m4bmaker.json get args.mode, or single for json
+            watch_options = {k: v for k, v in options.items() if k != "mode"}
+            watcher = Watcher(
+                args.root,
+                args.log_dir,
+                mode=args.mode,
+                interval=args.interval,
+                settle=args.settle,
+                workers=args.workers,
+                slots=args.slots,
+                **watch_options,
+            )
+            signal.signal(signal.SIGTERM, lambda *_: watcher.stop())
+            watcher.run(once=args.once)
+            print(json.dumps(watcher.queue.stats(), indent=2))
+            return
 
         m4b = M4BMaker(
             json_path=args.json_path,
-            mode=args.mode,
-            output_bitrate=args.output_bitrate,
             log_path=args.log_path,
+            rebuild_probe_cache=args.rebuild_probe_cache,
+            progress_callback=print_progress if args.progress else None,
+            resume=getattr(args, "resume", False),
+            **options,
         )
         if args.subparser_name == "to_dict":
             print(json.dumps(m4b.to_dict(), indent=2))
+        if args.subparser_name == "verify":
+            results = m4b.verify(deep=args.deep)
+            print(json.dumps(results, indent=2))
+            if not all(result["ok"] for result in results):
+                sys.exit(1)
+        if args.subparser_name == "index":
+            print(json.dumps(m4b.write_seek_index(), indent=2))
         if args.subparser_name == "convert":
-            m4b.convert()
+            try:
+                m4b.convert()
+            finally:
+                if args.progress:
+                    print(file=sys.stderr)
+                if args.report:
+                    args.report.write_text(
+                        json.dumps(m4b.report.to_dict(), indent=2), encoding="utf-8"
+                    )
     except Exception as e:
         print(f"Error: {e}")
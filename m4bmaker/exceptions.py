@@ -5,8 +5,13 @@ import sys
 class LoggedException(Exception):
     """Custom exception class that logs the error message."""
 
-    def __init__(self, message: str, logger: logging.Logger) -> None:
+    def __init__(
+        self, message: str, logger: logging.Logger, details: str | None = None
+    ) -> None:
         super().__init__(message)
+        self.details = details
+        if details:
+            message = f"{message}\n{details}"
         logger.error(message, exc_info=bool(sys.exc_info()[2]))
         logger.info("Program stopped!")
 
@@ -0,0 +1,261 @@
+import mmap
+import struct
+from pathlib import Path
+
+from m4bmaker.mp4 import (
+    edited_duration,
+    find_box,
+    handler_type,
+    iter_boxes,
+    media_header,
+)
+from m4bmaker.types import MediaInfo
+
+# MPEG audio bitrates in kbps, indexed by (is MPEG-1, layer) and the bitrate index
+MP3_BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+# sample rates indexed by the version bits (3: MPEG-1, 2: MPEG-2, 0: MPEG-2.5)
+MP3_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    0: [11025, 12000, 8000],
+}
+MP3_CODECS = {1: "mp1", 2: "mp2", 3: "mp3"}
+MP3_SYNC_SEARCH = 64 * 1024  # how far past the ID3v2 tag to look for the first frame
+LAME_TAGS = (b"LAME", b"Lavc", b"Lavf", b"GOGO")
+# MPEG-4 objectTypeIndication values found in the esds box of an mp4a sample entry
+MP4_OBJECT_TYPES = {
+    0x40: "aac", 0x66: "aac", 0x67: "aac", 0x68: "aac", 0x69: "mp3", 0x6B: "mp3",
+}  # fmt: skip
+# MPEG-4 audioObjectType of the AudioSpecificConfig, named like ffprobe's profile
+AAC_PROFILES = {
+    1: "Main", 2: "LC", 3: "SSR", 4: "LTP", 5: "HE-AAC", 23: "LD", 29: "HE-AACv2",
+    39: "ELD",
+}  # fmt: skip
+MP4_CODECS = {
+    b"alac": "alac", b".mp3": "mp3", b"ac-3": "ac3", b"ec-3": "eac3",
+    b"fLaC": "flac", b"Opus": "opus",
+}  # fmt: skip
+
+
+def inspect(path: Path) -> MediaInfo | None:
+    """Reads the stream parameters of an .mp3/.m4a file without running ffprobe.
+
+    Returns None when the file can't be parsed, so the caller can fall back to ffprobe.
+    """
+    try:
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if Path(path).suffix.lower() == ".mp3":
+                    return _inspect_mp3(mm)
+                return _inspect_mp4(mm)
+    except (OSError, ValueError, IndexError, struct.error):  # truncated or corrupt
+        return None
+
+
+def _skip_id3v2(mm: mmap.mmap) -> int:
+    pos = 0
+    while mm[pos : pos + 3] == b"ID3":
+        flags = mm[pos + 5]
+        size = 0
+        for byte in mm[pos + 6 : pos + 10]:
+            size = (size << 7) | (byte & 0x7F)
+        pos += 10 + size + (10 if flags & 0x10 else 0)
+    return pos
+
+
+def _parse_mp3_header(mm: mmap.mmap, pos: int) -> dict | None:
+    if pos + 4 > len(mm):
+        return None
+    header = struct.unpack_from(">I", mm, pos)[0]
+    version = (header >> 19) & 3
+    layer = 4 - ((header >> 17) & 3)
+    bitrate_index = (header >> 12) & 0xF
+    sample_rate_index = (header >> 10) & 3
+    if (header >> 21) != 0x7FF or version == 1 or layer == 4:
+        return None
+    if bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None  # free-format and reserved values are left to ffprobe
+    mpeg1 = version == 3
+    bitrate = MP3_BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][sample_rate_index]
+    padding = (header >> 9) & 1
+    if layer == 1:
+        length = (12 * bitrate // sample_rate + padding) * 4
+        samples = 384
+    else:
+        samples = 1152 if mpeg1 or layer == 2 else 576
+        length = samples // 8 * bitrate // sample_rate + padding
+    return {
+        "version": version,
+        "layer": layer,
+        "bitrate": bitrate,
+        "sample_rate": sample_rate,
+        "channels": 1 if (header >> 6) & 3 == 3 else 2,
+        "samples": samples,
+        "length": length,
+    }
+
+
+def _inspect_mp3(mm: mmap.mmap) -> MediaInfo | None:
+    start = _skip_id3v2(mm)
+    end = len(mm) - (128 if mm[-128:-125] == b"TAG" else 0)
+    for pos in range(start, min(start + MP3_SYNC_SEARCH, end - 4)):
+        if mm[pos] != 0xFF:
+            continue
+        frame = _parse_mp3_header(mm, pos)
+        if not frame:
+            continue
+        following = _parse_mp3_header(mm, pos + frame["length"])
+        if following and all(
+            following[key] == frame[key] for key in ("version", "layer", "sample_rate")
+        ):
+            break
+    else:
+        return None
+
+    # the Xing/Info tag sits right after the side information of the first frame
+    if frame["version"] == 3:
+        side_info = 32 if frame["channels"] == 2 else 17
+    else:
+        side_info = 17 if frame["channels"] == 2 else 9
+    tag = pos + 4 + side_info
+    frames = audio_bytes = 0
+    delay = padding = 0
+    if mm[tag : tag + 4] in (b"Xing", b"Info"):
+        flags = struct.unpack_from(">I", mm, tag + 4)[0]
+        offset = tag + 8
+        if flags & 0x1:
+            frames = struct.unpack_from(">I", mm, offset)[0]
+            offset += 4
+        if flags & 0x2:
+            audio_bytes = struct.unpack_from(">I", mm, offset)[0]
+            offset += 4
+        offset += (100 if flags & 0x4 else 0) + (4 if flags & 0x8 else 0)
+        if mm[offset : offset + 4] in LAME_TAGS:
+            gapless = int.from_bytes(mm[offset + 21 : offset + 24], "big")
+            delay, padding = gapless >> 12, gapless & 0xFFF
+        pos += frame["length"]  # the tag frame itself holds no audio
+    elif mm[pos + 36 : pos + 40] == b"VBRI":
+        audio_bytes, frames = struct.unpack_from(">II", mm, pos + 46)
+        pos += frame["length"]
+
+    if frames:
+        samples = frames * frame["samples"] - delay - padding
+        duration = max(samples, 0) / frame["sample_rate"]
+        bitrate = round((audio_bytes or end - pos) * 8 / duration) if duration else 0
+    else:  # constant bitrate: the duration follows from the size of the audio data
+        duration = (end - pos) * 8 / frame["bitrate"]
+        bitrate = frame["bitrate"]
+    return {
+        "duration": duration,
+        "codec": MP3_CODECS[frame["layer"]],
+        "sample_rate": frame["sample_rate"],
+        "channels": frame["channels"],
+        "bitrate": bitrate,
+        "profile": "",
+    }
+
+
+def _read_descriptor(buf, pos: int) -> tuple[int, int, int]:
+    # MPEG-4 descriptor: 1-byte tag, 1-4 bytes of 7-bit length
+    tag, size = buf[pos], 0
+    pos += 1
+    for _ in range(4):
+        byte = buf[pos]
+        pos += 1
+        size = (size << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            break
+    return tag, pos, size
+
+
+def _parse_esds(buf, start: int, end: int) -> tuple[int, int, int]:
+    """Returns (objectTypeIndication, avgBitrate, audioObjectType) from an esds box.
+
+    The audioObjectType is 0 when there is no AudioSpecificConfig.
+    """
+    tag, pos, _ = _read_descriptor(buf, start + 4)  # skip version & flags
+    if tag != 0x03:
+        return 0, 0, 0
+    flags = buf[pos + 2]
+    pos += 3
+    if flags & 0x80:
+        pos += 2
+    if flags & 0x40:
+        pos += buf[pos] + 1
+    if flags & 0x20:
+        pos += 2
+    tag, pos, _ = _read_descriptor(buf, pos)
+    if tag != 0x04:
+        return 0, 0, 0
+    object_type = buf[pos]
+    avg_bitrate = struct.unpack_from(">I", buf, pos + 9)[0]
+    audio_object_type = 0
+    if pos + 13 < end:
+        tag, pos, size = _read_descriptor(buf, pos + 13)
+        if tag == 0x05 and size and pos + size <= end:
+            # 5 bits, 31 escapes to 32 + the next 6 bits
+            audio_object_type = buf[pos] >> 3
+            if audio_object_type == 31 and size > 1:
+                bits = (buf[pos] << 8 | buf[pos + 1]) >> 5
+                audio_object_type = 32 + (bits & 0x3F)
+    return object_type, avg_bitrate, audio_object_type
+
+
+def _inspect_mp4(mm: mmap.mmap) -> MediaInfo | None:
+    moov = find_box(mm, 0, len(mm), b"moov")
+    if not moov:
+        return None
+    for kind, trak, trak_end in iter_boxes(mm, *moov):
+        if kind != b"trak":
+            continue
+        mdia = find_box(mm, trak, trak_end, b"mdia")
+        if not mdia or handler_type(mm, mdia) != b"soun":
+            continue
+        mdhd = find_box(mm, *mdia, b"mdhd")
+        stsd = find_box(mm, *mdia, b"minf", b"stbl", b"stsd")
+        if not mdhd or not stsd:
+            return None
+        timescale, length = media_header(mm, mdhd)
+        sample_entry = next(iter_boxes(mm, stsd[0] + 8, stsd[1]), None)
+        if not sample_entry:
+            return None
+        entry_kind, entry, entry_end = sample_entry
+        channels = struct.unpack_from(">H", mm, entry + 16)[0]
+        sample_rate = struct.unpack_from(">I", mm, entry + 24)[0] >> 16
+        codec, bitrate, profile = MP4_CODECS.get(entry_kind), 0, ""
+        if entry_kind == b"mp4a":
+            esds = find_box(mm, entry + 28, entry_end, b"esds")
+            object_type, bitrate, audio_object_type = (
+                _parse_esds(mm, *esds) if esds else (0, 0, 0)
+            )
+            codec = MP4_OBJECT_TYPES.get(object_type)
+            if codec == "aac":
+                profile = AAC_PROFILES.get(audio_object_type, "")
+        if not codec or not timescale:
+            return None
+        # as decoded, without the encoder priming & padding hidden by the edit list
+        duration = edited_duration(mm, moov, (trak, trak_end), timescale, length)
+        if not bitrate and duration:
+            mdat_size = sum(
+                end - payload
+                for kind, payload, end in iter_boxes(mm, 0, len(mm))
+                if kind == b"mdat"
+            )
+            bitrate = round(mdat_size * 8 / duration)
+        return {
+            "duration": duration,
+            "codec": codec,
+            "sample_rate": sample_rate,
+            "channels": channels,
+            "bitrate": bitrate,
+            "profile": profile,
+        }
+    return None
@@ -3,13 +3,14 @@ from pathlib import Path
 
 
 def logger_factory(
-    name: str = __name__,
+    name: str | None = None,
     log_path: Path = Path.cwd() / "m4bmaker.log",
     console_level: int = logging.WARNING,
     file_level: int = logging.DEBUG,
+    file_mode: str = "w",
 ) -> logging.Logger:
     """Factory method to create a logger."""
-    logger = logging.getLogger(name)
+    logger = logging.getLogger(name or __name__)
     logger.setLevel(logging.DEBUG)
 
     if logger.handlers:  # Avoid adding duplicate handlers
@@ -26,9 +27,23 @@ def logger_factory(
     console_handler.setFormatter(formatter)
     logger.addHandler(console_handler)
 
-    file_handler = logging.FileHandler(log_path, encoding="utf-8", mode="w")
+    file_handler = logging.FileHandler(log_path, encoding="utf-8", mode=file_mode)
     file_handler.setLevel(file_level)
     file_handler.setFormatter(formatter)
     logger.addHandler(file_handler)
 
     return logger
+
+
+def close_logger(logger: logging.Logger) -> None:
+    """Closes the handlers of a logger, e.g. one of many books in a batch."""
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+
+
+class PrefixLoggerAdapter(logging.LoggerAdapter):
+    """Logger adapter that tags every message with extra["prefix"]."""
+
+    def process(self, msg, kwargs):
+        return f"[{self.extra['prefix']}] {msg}", kwargs
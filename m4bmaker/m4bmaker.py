@@ -1,23 +1,105 @@
+import asyncio
+import codecs
 import os
+import hashlib
+import itertools
 import json
+import logging
+import math
+import queue
+import re
 import shutil
+import sqlite3
+import struct
 import subprocess as sp
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from enum import Enum
+from functools import cache, cached_property
 from pathlib import Path
-from typing import Literal
+from typing import AsyncIterator, Callable, Generator, Iterator, Literal
 
+from m4bmaker import inspector, mp4
+from m4bmaker.cache import EncodeCache, ProbeCache, default_cache_dir
+from m4bmaker.checkpoint import CheckpointJournal
 from m4bmaker.exceptions import LoggedFileError, LoggedValueError
-from m4bmaker.logger import logger_factory
-from m4bmaker.types import TrackData
+from m4bmaker.logger import PrefixLoggerAdapter, logger_factory
+from m4bmaker.progress import ProgressTracker
+from m4bmaker.report import BOOK, RunReport, wait_process
+from m4bmaker.tempfiles import TempFiles, interrupt_on_sigterm
+from m4bmaker.types import (
+    ChapterData,
+    FFCommand,
+    MediaInfo,
+    ProgressEvent,
+    ResourceUsage,
+    TrackData,
+)
+
+# the ff commands of a track, in groups that may run in parallel & their workers
+TrackSteps = Generator[tuple[list[FFCommand], int], None, None]
+
+
+@cache
+def ff_available() -> bool:
+    # looked up once per process, not for every book of a batch or watch folder
+    return bool(shutil.which("ffmpeg") and shutil.which("ffprobe"))
 
 
 class M4BMaker:
     MODES = Enum("Mode", ["json", "single", "chapter"])
     AUDIO_BITRATES = Enum("AudioBitrate", ["32k", "64k", "96k", "128k"])
     ILLEGAL_CHARS = r"""<>"|?*'"""
+    PIPELINES = Enum("Pipeline", ["single_pass", "two_pass"])
+    # streaming writes the moov first, fragmented splits the audio into moof+mdat
+    # fragments behind a small moov
+    PROFILES = Enum("Profile", ["default", "streaming", "fragmented"])
     INPUT_TYPES = [".mp3", ".m4a"]
     OUTPUT_TYPE = ".m4b"
+    OUTPUT_DIR = "output"  # inside the book path
+    # by output suffix
+    MUXERS = {".m4b": "ipod", ".m4a": "ipod", ".mp3": "mp3", ".m3u8": "hls"}
+    HLS_DIR = "{stem}.hls"  # next to the .m4b of a track
+    HLS_PLAYLIST = "index.m3u8"
+    HLS_CHAPTERS = "chapters.json"
+    SEEK_INDEX = "{name}.seek.json"  # next to the .m4b of a track
+    CHECKPOINTS = "checkpoints.jsonl"  # journal of completed ff runs, in scratch
+    # duration mismatch allowed by verify(), the larger of seconds & a ratio
+    VERIFY_TOLERANCE = 1.0
+    VERIFY_TOLERANCE_RATIO = 0.001
+    VERIFY_SAMPLES = 3  # windows decoded per file by verify(deep=True)
+    VERIFY_SAMPLE_SECONDS = 5
+    SPACE_MARGIN = 1.1  # container overhead & bitrate jitter of the space estimates
+    # moov reserved at the start of streaming outputs: stsz takes 4 bytes per aac
+    # frame, ffmpeg starts a chunk every MiB, plus the tags, chapters and cover
+    MOOV_BASE_SIZE = 64 * 1024
+    MOOV_FRAME_SIZE = 4
+    MOOV_CHUNK_SIZE = 24
+    MOOV_CHAPTER_SIZE = 64
+    MANIFEST_VERSION = 1
+    # "level+" prefixes every ffmpeg log line with its level, e.g. "[warning]"
+    FF_COMMON_ARGS = ["-loglevel", "level+info", "-hide_banner", "-y", "-stats"]
+    FF_LOG_LEVELS = {
+        "panic": logging.ERROR,
+        "fatal": logging.ERROR,
+        "error": logging.ERROR,
+        "warning": logging.WARNING,
+    }
+    # the level of a line, after the "[mp3 @ 0x55...] " contexts that precede it
+    FF_LEVEL_RE = re.compile(
+        r"^(?:\[[^\]]* @ 0x[0-9a-f]+\] )*"
+        r"\[(panic|fatal|error|warning|info|verbose|debug|trace)\]"
+    )
+    FF_STDERR_TAIL = 50  # stderr lines kept in memory for the error of a failed run
+    AAC_FRAME_SAMPLES = 1024  # also the encoder priming of ffmpeg's aac encoder
+    PASSTHROUGH_CODECS = ["aac"]
+    PASSTHROUGH_PROFILES = ["LC"]  # HE-AAC(v2) inputs are re-encoded
+    PASSTHROUGH_BITRATE_TOLERANCE = 1.05  # container overhead & encoder jitter
+    SLOT_TIMEOUT = 1.0  # seconds between abort checks while waiting for a slot
+    SLOT_POLL = 0.1  # seconds between slot attempts of async runs
 
     def __init__(
         self,
@@ -25,11 +107,41 @@ class M4BMaker:
         mode: Literal["json", "single", "chapter"] = "json",
         output_bitrate: Literal["32k", "64k", "96k", "128k"] = "64k",
         log_path: Path = Path.cwd() / "m4bmaker.log",
+        probe_workers: int | None = None,
+        jobs: int = 1,
+        pipeline: Literal["single_pass", "two_pass"] = "two_pass",
+        profile: Literal["default", "streaming", "fragmented"] = "default",
+        fragment_duration: float = 10.0,
+        hls: bool = False,
+        hls_segment_duration: float = 6.0,
+        passthrough: bool = True,
+        segment_parallel: bool = True,
+        probe_cache: bool | ProbeCache = True,
+        rebuild_probe_cache: bool = False,
+        cache_dir: Path | None = None,
+        encode_cache: bool = False,
+        encode_cache_size: int = 20 * 1024**3,
+        progress_callback: Callable[[ProgressEvent], None] | None = None,
+        log_name: str | None = None,
+        slots: threading.Semaphore | None = None,
+        output_dir: Path | None = None,
+        scratch_dir: Path | None = None,
+        keep_temp: bool = False,
+        temp_ttl: float = 24 * 3600,
+        resume: bool = False,
+        verify_output: bool = False,
+        seek_index: bool = False,
+        seek_grid: float = 30.0,
     ):
-        self.lg = logger_factory(log_path=log_path)
+        self.lg = logger_factory(name=log_name, log_path=log_path)
         self.lg.info("Initializing AudioBook class.")
-        if not shutil.which("ffmpeg") or not shutil.which("ffprobe"):
+        if not ff_available():
             raise LoggedFileError("ffmpeg/ffprobe not found.", self.lg)
+        self._processes: set[sp.Popen] = set()
+        self._processes_lock = threading.Lock()
+        self._abort = threading.Event()
+        # ff process slots shared with other books, e.g. by m4bmaker.batch
+        self.slots = slots
 
         try:
             self.json_path = Path(json_path)
@@ -37,32 +149,140 @@ class M4BMaker:
                 self._raw_data = json.load(f)
             self.mode = self.MODES[mode.lower()].name
             self.output_bitrate = self.AUDIO_BITRATES[output_bitrate.lower()].name
+            self.pipeline = self.PIPELINES[pipeline.lower()].name
+            self.profile = self.PROFILES[profile.lower()].name
         except FileNotFoundError as exc:
             raise LoggedFileError(f"JSON file not found: {json_path}", self.lg) from exc
         except json.JSONDecodeError as exc:
             raise LoggedValueError(f"Invalid JSON file: {json_path}", self.lg) from exc
         except KeyError as exc:
-            raise LoggedValueError(f"Invalid mode or bitrate: {exc}", self.lg) from exc
+            raise LoggedValueError(
+                f"Invalid mode, bitrate, pipeline or profile: {exc}", self.lg
+            ) from exc
+        self.probe_workers = probe_workers or os.cpu_count() or 1
+        if self.probe_workers < 1:
+            raise LoggedValueError(f"Invalid probe workers: {probe_workers}", self.lg)
+        self.jobs = jobs
+        if self.jobs < 1:
+            raise LoggedValueError(f"Invalid number of jobs: {jobs}", self.lg)
+        self.fragment_duration = fragment_duration
+        if self.fragment_duration <= 0:
+            raise LoggedValueError(
+                f"Invalid fragment duration: {fragment_duration}", self.lg
+            )
+        # HLS of every track, cut from its .m4b by stream copy
+        self.hls = hls
+        self.hls_segment_duration = hls_segment_duration
+        if self.hls_segment_duration <= 0:
+            raise LoggedValueError(
+                f"Invalid HLS segment duration: {hls_segment_duration}", self.lg
+            )
 
         self.lg.info(f"Selected mode: {self.mode}")
         self.lg.info(f"Selected output bitrate: {self.output_bitrate}")
+        self.lg.info(f"Selected pipeline: {self.pipeline}")
+        self.lg.info(f"Selected profile: {self.profile}")
+        self.passthrough = passthrough
+        self.segment_parallel = segment_parallel
+        self.progress_callback = progress_callback
+        self._progress: ProgressTracker | None = None
+        # hash of the inputs in the manifest of each track, keys its checkpoints
+        self._input_hashes: dict[str, str] = {}
+        self.report = RunReport()
+        self.lg.info(f"Probe workers: {self.probe_workers}, jobs: {self.jobs}")
+        self.cache_dir = Path(cache_dir or default_cache_dir())
+        self.probe_cache = None
+        if isinstance(probe_cache, ProbeCache):  # shared with other books, kept warm
+            self.probe_cache = probe_cache
+        elif probe_cache or rebuild_probe_cache:
+            try:
+                self.probe_cache = ProbeCache(self.cache_dir)
+                if rebuild_probe_cache:
+                    self.lg.info("Rebuilding the probe cache.")
+                    self.probe_cache.clear()
+            except (OSError, sqlite3.Error) as exc:
+                self.lg.warning(f"Probe cache disabled, can't open it: {exc}")
+                self.probe_cache = None
+        # registry of the temp files of every run, to sweep the ones of crashed runs
+        registry_dir = self.cache_dir / "runs"
+        try:
+            registry_dir.mkdir(parents=True, exist_ok=True)
+        except OSError as exc:
+            self.lg.warning(f"Orphaned temp files won't be swept: {exc}")
+            registry_dir = None
+        self.temp_files = TempFiles(registry_dir, keep=keep_temp)
+        self.temp_ttl = temp_ttl
+        self.encode_cache = None
+        if encode_cache:
+            try:
+                self.encode_cache = EncodeCache(self.cache_dir, encode_cache_size)
+            except (OSError, sqlite3.Error) as exc:
+                self.lg.warning(f"Encode cache disabled, can't open it: {exc}")
         self.lg.debug(f"Loaded JSON data:\n{json.dumps(self._raw_data, indent=2)}")
 
         self._validate_book_path()
         self._validate_book_metadata()
         self._validate_book_cover()
 
-        self.output_path = self.path / "output"
-        self.tracks = {
-            self.MODES.json.name: self._prep_tracks_json_mode,
-            self.MODES.single.name: self._prep_tracks_single_mode,
-            self.MODES.chapter.name: self._prep_tracks_chapter_mode,
-        }[self.mode]()
-        self._validate_tracks()
+        # final files go to <output_dir>/<title>, or <book>/output without one
+        self.output_path = self.path / self.OUTPUT_DIR
+        if output_dir:
+            self.output_path = Path(output_dir).resolve() / self._cleaner(self.title)
+        # intermediates go next to the finals, or to a namespace of the book in
+        # scratch_dir, so books sharing a scratch volume never clash
+        self.scratch_path = self.output_path
+        if scratch_dir:
+            book_id = hashlib.sha256(str(self.path).encode("utf-8")).hexdigest()[:12]
+            self.scratch_path = (
+                Path(scratch_dir).resolve() / f"{self.path.name}-{book_id}"
+            )
+        self.lg.info(f"Output: {self.output_path}, scratch: {self.scratch_path}")
+        # with resume, intermediates journaled by an interrupted run are reused
+        self.resume = resume
+        self.verify_output = verify_output  # verify() after every convert
+        self.seek_index = seek_index  # write_seek_index() after every convert
+        self.seek_grid = seek_grid
+        if self.seek_grid <= 0:
+            raise LoggedValueError(f"Invalid seek index grid: {seek_grid}", self.lg)
+        self.checkpoints = CheckpointJournal(self.scratch_path / self.CHECKPOINTS)
+        # tracks, probing and temp files are lazy phases, computed on first access
+        self.lg.info("Configuration loaded.")
+
+    @cached_property
+    def tracks(self) -> list[TrackData]:
+        # plan phase: tracks & chapters, validated, with the paths of their temp files
+        with self.report.timed(BOOK, "plan"):
+            tracks = {
+                self.MODES.json.name: self._prep_tracks_json_mode,
+                self.MODES.single.name: self._prep_tracks_single_mode,
+                self.MODES.chapter.name: self._prep_tracks_chapter_mode,
+            }[self.mode]()
+            self._validate_tracks(tracks)
+        for tr, track in enumerate(tracks):
+            track["temp_files"] = {
+                "input_list": self.scratch_path / f"track_{tr + 1}_files.txt",
+                "chapter_data": self.scratch_path / f"track_{tr + 1}_chapters.txt",
+            }
+            track["duration"] = None
+        self.lg.info("Data validation & planning complete.")
+        return tracks
 
-        self._prep_temp_files()
+    @cached_property
+    def _media_info(self) -> dict[Path, MediaInfo]:
+        # probe phase: stream parameters of every input file, and the track durations
+        with self.report.timed(BOOK, "probe"):
+            media_info = self._probe_files()
+        self._set_durations(media_info)
+        return media_info
 
-        self.lg.info("Data validation & preparation complete.")
+    def _set_durations(self, media_info: dict[Path, MediaInfo]) -> None:
+        for track in self.tracks:
+            seconds = sum(
+                media_info[file]["duration"]
+                for chapter in track["chapters"]
+                for file in chapter["files"]
+            )
+            track["duration"] = datetime.fromtimestamp(seconds).strftime("%H:%M:%S")
         self.lg.debug(f"Processed data:\n{json.dumps(self.to_dict(), indent=2)}")
 
     def __del__(self) -> None:
@@ -108,12 +328,12 @@ class M4BMaker:
             raise LoggedFileError(f"Bad book cover type: {cover.suffix}", self.lg)
         self.cover = cover
 
-    def _validate_tracks(self) -> None:
+    def _validate_tracks(self, tracks: list[TrackData]) -> None:
         self.lg.debug("Validating tracks.")
         input_formats = set()
-        if not self.tracks:
+        if not tracks:
             raise LoggedFileError("Book metadata as no tracks.", self.lg)
-        for track in self.tracks:
+        for track in tracks:
             if not track["chapters"]:
                 raise LoggedFileError(
                     f"Track has no chapters: {track['title']}", self.lg
@@ -130,7 +350,7 @@ class M4BMaker:
                 f"Multiple input file formats found: {input_formats}", self.lg
             )
         self._input_format = input_formats.pop()
-        self.lg.debug(f"Will create {len(self.tracks)} track(s).")
+        self.lg.debug(f"Will create {len(tracks)} track(s).")
 
     def _prep_tracks_single_mode(self) -> list[TrackData]:
         # combine all input files into a single file
@@ -189,63 +409,184 @@ class M4BMaker:
                     chapter["files"][f] = file_path
         return self._raw_data["tracks"]
 
-    def _prep_temp_files(self):
-        self.lg.debug("Preparing temporary files.")
-        self.output_path.mkdir(parents=True, exist_ok=True)
-        for tr, track in enumerate(self.tracks):
-            input_list_path = self.output_path / f"track_{tr + 1}_files.txt"
-            with open(input_list_path, "w", encoding="utf-8") as f:
-                for chapter in track["chapters"]:
-                    for file in chapter["files"]:
-                        file = str(file).replace("'", "'\\''")
-                        f.write(f"file '{file}'\n")
-            track["temp_files"] = track.get("temp_files", {})
-            track["temp_files"]["input_list"] = input_list_path
-        self._prep_chapter_data_files()
-        self.lg.debug(f"{len(self.tracks) * 2} text files created: {self.output_path}")
-
-    def _prep_chapter_data_files(self):
-        self.lg.debug("Preparing chapter data files.")
-        for tr, track in enumerate(self.tracks):
-            start_time = 0
-            chapter_data = ""
-            for chapter in track["chapters"]:
-                duration = 0
-                for file in chapter["files"]:
-                    cmd = [
-                        "ffprobe", "-i", file, "-loglevel", "quiet", "-hide_banner",
-                        "-show_entries", "format=duration", "-of", "csv=p=0",
-                    ]  # fmt: skip
-                    duration += float(self._run_ff(cmd))
-
-                chapter_data += f"[CHAPTER]\nTIMEBASE=1/1\nSTART={int(start_time)}\n"
-                chapter_data += f"END={int(start_time) + int(duration)}\n"
-                chapter_data += f"title={chapter['title']}\n"
-                start_time += duration
-
-            chapter_data_file = self.output_path / f"track_{tr + 1}_chapters.txt"
-            with open(chapter_data_file, "w", encoding="utf-8") as f:
-                f.write(";FFMETADATA1\n")
-                f.write(f"title={track['title']}\n")
-                f.write(f"artist={self.author}\n")
-                f.write(f"album_artist={self.author}\n")
-                f.write(f"composer={self.narrator}\n")
-                f.write(f"album={self.title}\n")
-                f.write(f"genre={self.genre}\n")
-                f.write(f"track={track['track_no']}\n")
-                f.write(f"disc={self.disc}\n")
-                f.write(f"date={self.year}\n")
-                f.write(chapter_data)
+    def _prep_temp_files(self, track: TrackData) -> None:
+        # temp files phase, only runs for tracks that are actually converted
+        self.lg.debug(f"Preparing temporary files of track {track['track_no']}.")
+        with self.report.timed(track["track_no"], "temp_files"):
+            self.output_path.mkdir(parents=True, exist_ok=True)
+            if self.scratch_path != self.output_path:
+                self.temp_files.register_dir(self.scratch_path)
+            self.scratch_path.mkdir(parents=True, exist_ok=True)
+            self.temp_files.register(*track["temp_files"].values())
+            self._write_input_list(
+                track["temp_files"]["input_list"],
+                [file for chapter in track["chapters"] for file in chapter["files"]],
+            )
+            self._prep_chapter_data_files(track)
+        self.lg.debug(f"2 text files created: {self.scratch_path}")
+
+    @staticmethod
+    def _probe_cmd(file: Path) -> list:
+        # fallback for files the in-process inspector can't parse
+        return [
+            "ffprobe", "-i", file, "-loglevel", "quiet", "-hide_banner",
+            "-select_streams", "a:0", "-of", "json", "-show_entries",
+            "format=duration,bit_rate"
+            ":stream=codec_name,profile,sample_rate,channels,bit_rate",
+        ]  # fmt: skip
+
+    def _probe_file(self, file: Path) -> MediaInfo:
+        return self._parse_probe(self._run_ff(self._probe_cmd(file), stage="ffprobe"))
+
+    @staticmethod
+    def _parse_probe(stdout: str) -> MediaInfo:
+        data = json.loads(stdout)
+        stream = (data.get("streams") or [{}])[0]
+        codec = stream.get("codec_name", "")
+        return {
+            "duration": float(data["format"]["duration"]),
+            "codec": codec,
+            "sample_rate": int(stream.get("sample_rate", 0)),
+            "channels": int(stream.get("channels", 0)),
+            "bitrate": int(stream.get("bit_rate", data["format"].get("bit_rate", 0))),
+            "profile": stream.get("profile", "") if codec == "aac" else "",
+        }
+
+    def _probe_files(self) -> dict[Path, MediaInfo]:
+        # read headers in-process, then ffprobe the remaining files in parallel
+        media_info, cached, remaining = self._probe_files_local()
+        if remaining:
+            self._probe_files_ffprobe(remaining, media_info)
+        self._store_probes(media_info, cached)
+        return media_info
+
+    def _probe_files_local(
+        self,
+    ) -> tuple[dict[Path, MediaInfo], dict[Path, MediaInfo], list[Path]]:
+        # cache & in-process inspector: (media info, cache hits, files left for ffprobe)
+        files = list(
+            dict.fromkeys(
+                file
+                for track in self.tracks
+                for chapter in track["chapters"]
+                for file in chapter["files"]
+            )
+        )
+        cached = self.probe_cache.get_many(files) if self.probe_cache else {}
+        media_info = dict(cached)
+        for file in files:
+            if file not in media_info and (info := inspector.inspect(file)):
+                media_info[file] = info
+        remaining = [file for file in files if file not in media_info]
+        self.lg.debug(
+            f"Probing {len(files)} file(s): {len(cached)} cached, "
+            f"{len(media_info) - len(cached)} read in-process, "
+            f"{len(remaining)} left for ffprobe ({self.probe_workers} worker(s))."
+        )
+        return media_info, cached, remaining
 
-            track["temp_files"]["chapter_data"] = chapter_data_file
-            track["duration"] = datetime.fromtimestamp(start_time).strftime("%H:%M:%S")
+    def _store_probes(
+        self, media_info: dict[Path, MediaInfo], cached: dict[Path, MediaInfo]
+    ) -> None:
+        if self.probe_cache and len(media_info) > len(cached):
+            self.probe_cache.put_many(
+                {file: info for file, info in media_info.items() if file not in cached}
+            )
+
+    def _probe_files_ffprobe(
+        self, files: list[Path], media_info: dict[Path, MediaInfo]
+    ) -> None:
+        results = self._run_parallel(self._probe_file, files, self.probe_workers)
+        media_info.update(zip(files, results))
+
+    def _run_parallel(self, func: Callable, items: list, workers: int) -> list:
+        # runs func over items in a thread pool, results keep the order of items. The
+        # first failure cancels the pending items and kills the running ff processes.
+        results = [None] * len(items)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(func, item): i for i, item in enumerate(items)}
+            try:
+                for future in as_completed(futures):
+                    results[futures[future]] = future.result()
+            except BaseException:
+                self._abort.set()
+                pool.shutdown(wait=False, cancel_futures=True)
+                self._kill_processes()
+                raise
+        return results
+
+    @staticmethod
+    def _escape_concat_path(file: Path) -> str:
+        return str(file).replace("'", "'\\''")
+
+    def _write_input_list(
+        self,
+        input_list_path: Path,
+        files: list[Path],
+        inpoint: float = 0.0,
+        outpoint: float = 0.0,
+    ) -> None:
+        # input file list for ffmpeg's concat demuxer, in & outpoint of the first &
+        # last file
+        with open(input_list_path, "w", encoding="utf-8") as f:
+            for i, file in enumerate(files):
+                f.write(f"file '{self._escape_concat_path(file)}'\n")
+                if i == 0 and inpoint:
+                    f.write(f"inpoint {inpoint:.6f}\n")
+                if i == len(files) - 1 and outpoint:
+                    f.write(f"outpoint {outpoint:.6f}\n")
+
+    def _chapter_times(self, track: TrackData) -> list[tuple[int, int]]:
+        # START & END of every chapter in whole seconds, from the probed durations
+        start_time = 0
+        times = []
+        for chapter in track["chapters"]:
+            duration = self._chapter_seconds(chapter)
+            times.append((int(start_time), int(start_time) + int(duration)))
+            start_time += duration
+        return times
+
+    def _chapter_data(self, track: TrackData) -> str:
+        # ffmetadata of a track: tags and chapters computed from the probed durations
+        chapter_data = ""
+        for chapter, (start, end) in zip(track["chapters"], self._chapter_times(track)):
+            chapter_data += f"[CHAPTER]\nTIMEBASE=1/1\nSTART={start}\n"
+            chapter_data += f"END={end}\n"
+            chapter_data += f"title={chapter['title']}\n"
+
+        return (
+            ";FFMETADATA1\n"
+            f"title={track['title']}\n"
+            f"artist={self.author}\n"
+            f"album_artist={self.author}\n"
+            f"composer={self.narrator}\n"
+            f"album={self.title}\n"
+            f"genre={self.genre}\n"
+            f"track={track['track_no']}\n"
+            f"disc={self.disc}\n"
+            f"date={self.year}\n"
+            f"{chapter_data}"
+        )
+
+    def _prep_chapter_data_files(self, track: TrackData) -> None:
+        self.lg.debug(f"Preparing chapter data file of track {track['track_no']}.")
+        with self.report.timed(track["track_no"], "chapter_data"):
+            chapter_data = self._chapter_data(track)
+            with open(track["temp_files"]["chapter_data"], "w", encoding="utf-8") as f:
+                f.write(chapter_data)
 
     def to_dict(self) -> dict:
         return {
             "path": str(self.path),
             "output_path": str(self.output_path),
+            "scratch_path": str(self.scratch_path),
             "mode": self.mode,
             "output_bitrate": self.output_bitrate,
+            "pipeline": self.pipeline,
+            "passthrough": self.passthrough,
+            "segment_parallel": self.segment_parallel,
+            "hls": self.hls,
+            "encode_cache": bool(self.encode_cache),
             "title": self.title,
             "author": self.author,
             "narrator": self.narrator,
@@ -269,41 +610,1301 @@ class M4BMaker:
                 }
                 for track in self.tracks
             ],
+            "report": self.report.to_dict(),
         }
 
-    def _run_ff(self, cmd: list[str]) -> None:
+    def _run_ff(
+        self,
+        cmd: list[str],
+        lg: logging.Logger | logging.LoggerAdapter | None = None,
+        progress: Callable[[dict], None] | None = None,
+        track_no: str = BOOK,
+        stage: str | None = None,
+    ) -> str:
+        # stage & track_no only label the run in the report, e.g. ("1/3", "encode")
+        lg = lg or self.lg
+        cmd = self._ff_cmd(cmd, progress)
         cmd_type = cmd[0]
-        self.lg.info(f"Running {cmd_type} command: {cmd}")
-        temp_files_remove = False
+        lg.info(f"Running {cmd_type} command: {cmd}")
+        if self.slots:
+            while not self.slots.acquire(timeout=self.SLOT_TIMEOUT):
+                if self._abort.is_set():
+                    raise LoggedFileError(f"{cmd_type} command aborted: {cmd}", lg)
         try:
-            process = sp.Popen(cmd, stdout=sp.PIPE, stderr=sp.PIPE, text=True)
-            stdout, stderr = process.communicate()
+            if self._abort.is_set():
+                raise LoggedFileError(f"{cmd_type} command aborted: {cmd}", lg)
+            start = time.monotonic()
+            # ff output holds tags in any encoding, a strict decode would end the
+            # reader threads and leave ffmpeg blocked on a full pipe
+            process = sp.Popen(
+                cmd,
+                stdout=sp.PIPE,
+                stderr=sp.PIPE,
+                encoding="utf-8",
+                errors="replace",
+            )
+            with self._processes_lock:
+                self._processes.add(process)
+                if self._abort.is_set():  # aborted while it was starting
+                    process.kill()
+            usage = None
+            try:
+                stdout, stderr_tail, usage = self._read_ff_output(process, lg, progress)
+            except BaseException:
+                process.kill()
+                raise
+            finally:
+                with self._processes_lock:
+                    self._processes.discard(process)
+                wall = time.monotonic() - start
+                self.report.record(track_no, stage or cmd_type, wall, usage)
 
             if stdout:
-                self.lg.debug(f"{cmd_type} stdout: {stdout.strip()}")
-            if stderr:
-                self.lg.error(f"{cmd_type} stderr: {stderr.strip()}")
+                lg.debug(f"{cmd_type} stdout: {stdout.strip()}")
             if process.returncode != 0:
-                raise sp.CalledProcessError(process.returncode, cmd, stderr)
+                raise sp.CalledProcessError(
+                    process.returncode, cmd, stderr="\n".join(stderr_tail)
+                )
             return stdout.strip()
         except sp.CalledProcessError as exc:
-            temp_files_remove = True
-            raise LoggedFileError(f"{cmd_type} command failed: {exc}", self.lg) from exc
+            raise LoggedFileError(
+                f"{cmd_type} command failed: {exc}", lg, details=exc.stderr
+            ) from exc
         finally:
-            if temp_files_remove:
-                self.remove_temp_files()
+            if self.slots:
+                self.slots.release()
+
+    @staticmethod
+    def _ff_cmd(cmd: list, progress: Callable[[dict], None] | None) -> list:
+        if progress:  # progress blocks are streamed on stdout instead of -stats
+            cmd = [
+                cmd[0], "-progress", "pipe:1",
+                *["-nostats" if arg == "-stats" else arg for arg in cmd[1:]],
+            ]  # fmt: skip
+        return cmd
+
+    def _log_ff_line(
+        self,
+        line: str,
+        lg: logging.Logger | logging.LoggerAdapter,
+        cmd_type: str,
+        stderr_tail: deque[str],
+    ) -> None:
+        if not (line := line.rstrip()):
+            return
+        stderr_tail.append(line)
+        level = logging.DEBUG
+        if match := self.FF_LEVEL_RE.match(line):
+            level = self.FF_LOG_LEVELS.get(match[1], level)
+        lg.log(level, f"{cmd_type}: {line}")
+
+    @staticmethod
+    def _parse_progress_line(
+        line: str, block: dict, progress: Callable[[dict], None]
+    ) -> dict:
+        # returns the block still being read, a new one after each complete block
+        key, _, value = line.strip().partition("=")
+        block[key] = value
+        if key == "progress":  # last line of every progress block
+            progress(block)
+            return {}
+        return block
+
+    def _read_ff_output(
+        self,
+        process: sp.Popen,
+        lg: logging.Logger | logging.LoggerAdapter,
+        progress: Callable[[dict], None] | None,
+    ) -> tuple[str, deque[str], ResourceUsage | None]:
+        # Both pipes are streamed line by line: stderr goes to the logger in a thread
+        # and only its last lines are kept, stdout is parsed for progress blocks.
+        cmd_type = process.args[0]
+        stderr_tail = deque(maxlen=self.FF_STDERR_TAIL)
+
+        def read_stderr() -> None:
+            for line in process.stderr:
+                try:
+                    self._log_ff_line(line, lg, cmd_type, stderr_tail)
+                except Exception:  # keep draining, or ffmpeg blocks on the pipe
+                    pass
+
+        stderr_reader = threading.Thread(target=read_stderr, daemon=True)
+        stderr_reader.start()
+        stdout_lines, block = [], {}
+        for line in process.stdout:
+            if not progress:
+                stdout_lines.append(line)
+                continue
+            block = self._parse_progress_line(line, block, progress)
+        stderr_reader.join()
+        usage = wait_process(process)
+        return "".join(stdout_lines), stderr_tail, usage
+
+    def _kill_processes(self) -> None:
+        with self._processes_lock:
+            processes = list(self._processes)
+        for process in processes:
+            self.lg.debug(f"Killing process: {process.args}")
+            process.kill()
 
-    def remove_temp_files(self) -> None:
+    def remove_temp_files(self, completed: bool = True) -> None:
+        if self.temp_files.keep:
+            self.lg.info(f"Keeping temporary files: {self.temp_files.registry}")
+            return
+        keep = set()
+        if self.resume and not completed:
+            keep = self._checkpointed_files()
+            self.lg.info(f"Keeping {len(keep) - 1} checkpointed file(s) to resume.")
         self.lg.info("Removing temporary files.")
-        for track in self.tracks:
-            for temp_file in track["temp_files"].values():
-                #Path(temp_file).unlink(missing_ok=True)
-                self.lg.debug(f"Temporary file removed: {temp_file}")
+        for temp_file in self.temp_files.cleanup(keep):
+            self.lg.debug(f"Temporary file removed: {temp_file}")
+
+    def _checkpointed_files(self) -> set[Path]:
+        return {self.checkpoints.path, *self.checkpoints.files()}
+
+    def _start_temp_files(self) -> None:
+        # With resume, the journal of an interrupted run is loaded before orphaned
+        # temp files are swept, so the intermediates it lists survive the sweep.
+        keep = set()
+        if self.resume:
+            entries = self.checkpoints.load()
+            keep = self._checkpointed_files()
+            self.lg.info(f"Resuming: {len(keep) - 1}/{entries} journaled output(s).")
+        if swept := self.temp_files.sweep(self.temp_ttl, keep):
+            self.lg.info(f"Removed {len(swept)} orphaned temporary file(s).")
+            for temp_file in swept:
+                self.lg.debug(f"Orphaned temporary file removed: {temp_file}")
+        if not self.resume:
+            self.checkpoints.discard()
+        self.temp_files.register(self.checkpoints.path, *keep)
 
     def convert(self) -> None:
         self.lg.info("Started converting files.")
         self.lg.info(f"mode: {self.mode}, output_bitrate: {self.output_bitrate}")
-        common_args = ["-loglevel", "info", "-hide_banner", "-y", "-stats"]
+        self.lg.info(f"pipeline: {self.pipeline}")
+        self.lg.info(f"Converting {len(self.tracks)} track(s), {self.jobs} job(s).")
+        # temp files are removed on success, failure, Ctrl+C and SIGTERM alike
+        with self.report.run(), interrupt_on_sigterm():
+            completed = False
+            try:
+                self._abort.clear()
+                self._start_temp_files()
+                self._media_info  # probe all tracks at once, before the conversion jobs
+                self._check_space()
+                self._start_progress()
+                tracks = list(enumerate(self.tracks))
+                self._run_parallel(self._convert_track, tracks, self.jobs)
+                completed = True
+            finally:
+                self.remove_temp_files(completed)
+            if self.encode_cache:
+                pruned = self.encode_cache.prune()
+                self.lg.debug(f"Encode cache pruned: {pruned}")
+            if self.verify_output:
+                self._verify_outputs()
+            if self.seek_index:
+                self.write_seek_index()
+        self.lg.info(f"All done! Get your new audiobook from: {self.output_path}")
+
+    def _start_progress(self) -> None:
+        self._progress = None
+        if self.progress_callback:
+            self._progress = ProgressTracker(
+                self.progress_callback,
+                {t["track_no"]: self._track_seconds(t) for t in self.tracks},
+            )
+
+    def iter_convert(self) -> Iterator[ProgressEvent]:
+        """Runs convert() in a thread and yields its progress events as they come.
+
+        Closing the iterator early aborts the conversion.
+        """
+        events, done, errors = queue.Queue(), object(), []
+        callback = self.progress_callback
+
+        def forward(event: ProgressEvent) -> None:
+            events.put(event)
+            if callback:
+                callback(event)
+
+        def run() -> None:
+            try:
+                self.convert()
+            except BaseException as exc:
+                errors.append(exc)
+            finally:
+                events.put(done)
+
+        self.progress_callback = forward
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        try:
+            while (event := events.get()) is not done:
+                yield event
+        finally:
+            if thread.is_alive():
+                self._abort.set()
+                self._kill_processes()
+            thread.join()
+            self.progress_callback = callback
+        if errors:
+            raise errors[0]
+
+    @classmethod
+    async def acreate(cls, *args, **kwargs) -> "M4BMaker":
+        """Async constructor, takes the arguments of M4BMaker().
+
+        Loads the config and plans the tracks in a thread, then probes the input files
+        with asyncio subprocesses.
+        """
+        m4b = await asyncio.to_thread(cls, *args, **kwargs)
+        await asyncio.to_thread(lambda: m4b.tracks)
+        await m4b._aprobe()
+        return m4b
+
+    async def aconvert(self) -> None:
+        """Async convert(): ffmpeg runs as asyncio subprocesses, `jobs` tracks at once.
+
+        Cancelling it kills the running ffmpeg processes. The temp files and chapter
+        data are written in threads, so the event loop is never blocked.
+        """
+        self.lg.info("Started converting files (async).")
+        self.lg.info(f"mode: {self.mode}, output_bitrate: {self.output_bitrate}")
+        self.lg.info(f"pipeline: {self.pipeline}")
+        self.lg.info(f"Converting {len(self.tracks)} track(s), {self.jobs} job(s).")
+        with self.report.run():
+            completed = False
+            try:
+                await asyncio.to_thread(self._start_temp_files)
+                await self._aprobe()
+                await asyncio.to_thread(self._check_space)
+                self._start_progress()
+                jobs = asyncio.Semaphore(self.jobs)
+                await self._agather(
+                    [
+                        self._aconvert_track(tr, track, jobs)
+                        for tr, track in enumerate(self.tracks)
+                    ]
+                )
+                completed = True
+            finally:  # also when cancelled, the ff processes are gone by now
+                self.remove_temp_files(completed)
+            if self.encode_cache:
+                pruned = await asyncio.to_thread(self.encode_cache.prune)
+                self.lg.debug(f"Encode cache pruned: {pruned}")
+            if self.verify_output:
+                await asyncio.to_thread(self._verify_outputs)
+            if self.seek_index:
+                await asyncio.to_thread(self.write_seek_index)
+        self.lg.info(f"All done! Get your new audiobook from: {self.output_path}")
+
+    async def aiter_convert(self) -> AsyncIterator[ProgressEvent]:
+        """Runs aconvert() in a task and yields its progress events as they come.
+
+        Closing the iterator early cancels the conversion.
+        """
+        events, done = asyncio.Queue(), object()
+        callback = self.progress_callback
+        loop = asyncio.get_running_loop()
+
+        def forward(event: ProgressEvent) -> None:
+            # also called from the threads writing temp files, e.g. encode cache hits
+            loop.call_soon_threadsafe(events.put_nowait, event)
+            if callback:
+                callback(event)
+
+        self.progress_callback = forward
+        task = asyncio.create_task(self.aconvert())
+        task.add_done_callback(lambda _: events.put_nowait(done))
+        try:
+            while (event := await events.get()) is not done:
+                yield event
+        finally:
+            task.cancel()  # no-op once it's done
+            await asyncio.gather(task, return_exceptions=True)
+            self.progress_callback = callback
+        task.result()
+
+    async def _aprobe(self) -> dict[Path, MediaInfo]:
+        # async twin of the _media_info property, runs once per instance as well
+        if "_media_info" in self.__dict__:
+            return self._media_info
+        with self.report.timed(BOOK, "probe"):
+            media_info, cached, remaining = await asyncio.to_thread(
+                self._probe_files_local
+            )
+            workers = asyncio.Semaphore(self.probe_workers)
+
+            async def probe(file: Path) -> MediaInfo:
+                async with workers:
+                    cmd = self._probe_cmd(file)
+                    return self._parse_probe(await self._arun_ff(cmd, stage="ffprobe"))
+
+            results = await self._agather([probe(file) for file in remaining])
+            media_info.update(zip(remaining, results))
+            await asyncio.to_thread(self._store_probes, media_info, cached)
+        await asyncio.to_thread(self._set_durations, media_info)
+        self.__dict__["_media_info"] = media_info
+        return media_info
+
+    @staticmethod
+    async def _agather(coros: list) -> list:
+        # gather that cancels the other coroutines on the first failure, killing
+        # their ff processes, and waits for them before raising
+        tasks = [asyncio.ensure_future(coro) for coro in coros]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def _aconvert_track(
+        self, tr: int, track: TrackData, jobs: asyncio.Semaphore
+    ) -> None:
+        async with jobs:
+            with self.report.track(track["track_no"], self._track_seconds(track)):
+                steps = self._track_steps(tr, track)
+                # the file work between the steps runs in a thread
+                while (step := await asyncio.to_thread(next, steps, None)) is not None:
+                    commands, workers = step
+                    limit = asyncio.Semaphore(workers)
+                    await self._agather(
+                        [self._arun_command(command, limit) for command in commands]
+                    )
+
+    async def _arun_command(self, command: FFCommand, limit: asyncio.Semaphore) -> None:
+        if await asyncio.to_thread(self._resumed, command):
+            return
+        async with limit:
+            try:
+                await self._arun_ff(
+                    command["cmd"],
+                    command["lg"],
+                    command["progress"],
+                    command["track_no"],
+                    command["stage"],
+                )
+            except LoggedFileError as exc:
+                if not self._use_fallback(command, exc):
+                    raise
+                await self._arun_ff(
+                    command["fallback"],
+                    command["lg"],
+                    command["progress"],
+                    command["track_no"],
+                    command["stage"],
+                )
+        await asyncio.to_thread(self._finish_command, command)
+
+    @staticmethod
+    async def _aread_lines(stream: asyncio.StreamReader) -> AsyncIterator[str]:
+        # universal newlines like the text pipes of _run_ff, -stats ends lines with \r
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        pending = ""
+        while chunk := await stream.read(65536):
+            lines = (pending + decoder.decode(chunk)).splitlines(keepends=True)
+            pending = lines.pop() if lines else ""
+            for line in lines:
+                yield line
+        if pending := pending + decoder.decode(b"", final=True):
+            yield pending
+
+    async def _arun_ff(
+        self,
+        cmd: list[str],
+        lg: logging.Logger | logging.LoggerAdapter | None = None,
+        progress: Callable[[dict], None] | None = None,
+        track_no: str = BOOK,
+        stage: str | None = None,
+    ) -> str:
+        # async twin of _run_ff, cancelling the awaiting task kills the child. The
+        # report only gets its wall time, asyncio doesn't expose the child's rusage.
+        lg = lg or self.lg
+        cmd = self._ff_cmd(cmd, progress)
+        cmd_type = cmd[0]
+        lg.info(f"Running {cmd_type} command: {cmd}")
+        if self.slots:  # a threading semaphore, shared with sync books
+            while not self.slots.acquire(blocking=False):
+                await asyncio.sleep(self.SLOT_POLL)
+        try:
+            start = time.monotonic()
+            process = await asyncio.create_subprocess_exec(
+                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+            stderr_tail = deque(maxlen=self.FF_STDERR_TAIL)
+
+            async def read_stderr() -> None:
+                async for line in self._aread_lines(process.stderr):
+                    self._log_ff_line(line, lg, cmd_type, stderr_tail)
+
+            async def read_stdout() -> str:
+                stdout_lines, block = [], {}
+                async for line in self._aread_lines(process.stdout):
+                    if not progress:
+                        stdout_lines.append(line)
+                        continue
+                    block = self._parse_progress_line(line, block, progress)
+                return "".join(stdout_lines)
+
+            try:
+                _, stdout = await asyncio.gather(read_stderr(), read_stdout())
+                await process.wait()
+            except BaseException:
+                if process.returncode is None:
+                    lg.debug(f"Killing process: {cmd}")
+                    process.kill()
+                    await process.wait()
+                raise
+            finally:
+                wall = time.monotonic() - start
+                self.report.record(track_no, stage or cmd_type, wall)
+
+            if stdout:
+                lg.debug(f"{cmd_type} stdout: {stdout.strip()}")
+            if process.returncode != 0:
+                raise sp.CalledProcessError(
+                    process.returncode, cmd, stderr="\n".join(stderr_tail)
+                )
+            return stdout.strip()
+        except sp.CalledProcessError as exc:
+            raise LoggedFileError(
+                f"{cmd_type} command failed: {exc}", lg, details=exc.stderr
+            ) from exc
+        finally:
+            if self.slots:
+                self.slots.release()
+
+    def verify(self, deep: bool = False) -> list[dict]:
+        """Checks every output file against the book, without decoding it.
+
+        Reads the boxes of each file in-process: moov & mdat, the duration against
+        the probed inputs, the chapter titles, the tags and the cover. With deep, a
+        few windows of every file are also decoded by ffmpeg, in parallel. Returns a
+        result per track, whose "errors" list what didn't match.
+        """
+        with self.report.timed(BOOK, "verify"):
+            results = [self._verify_track(track) for track in self.tracks]
+        if deep:
+            samples = [
+                (result, start)
+                for result in results
+                if result["duration"]
+                for start in self._sample_starts(result["duration"])
+            ]
+            self.lg.info(f"Decoding {len(samples)} sample(s) of {len(results)} files.")
+            workers = self.probe_workers
+            errors = self._run_parallel(self._decode_sample, samples, workers)
+            for (result, _), error in zip(samples, errors):
+                if error:
+                    result["errors"].append(error)
+                    result["ok"] = False
+        for result in results:
+            if not result["ok"]:
+                self.lg.warning(f"Verification failed: {result}")
+        return results
+
+    def _verify_outputs(self) -> None:
+        # post-convert hook: a track that fails is rebuilt by the next run
+        failed = []
+        for track, result in zip(self.tracks, self.verify()):
+            if not result["ok"]:
+                self._manifest_path(track).unlink(missing_ok=True)
+                failed.append(result)
+        if failed:
+            raise LoggedFileError(
+                f"{len(failed)} output file(s) failed verification: "
+                + "; ".join(f"{r['file']}: {' '.join(r['errors'])}" for r in failed),
+                self.lg,
+            )
+        self.lg.info(f"Verified {len(self.tracks)} output file(s).")
+
+    def _verify_track(self, track: TrackData) -> dict:
+        start = time.monotonic()
+        errors, info = [], {}
+        try:
+            info = mp4.read_structure(track["file"])
+        except (OSError, ValueError, struct.error) as exc:
+            errors.append(f"Unreadable: {exc}")
+        else:
+            boxes = info["boxes"]
+            for box in ("moov", "mdat"):
+                if box not in boxes:
+                    errors.append(f"No {box} box.")
+            if self.profile == self.PROFILES.streaming.name and (
+                {"moov", "mdat"} <= set(boxes)
+                and boxes.index("moov") > boxes.index("mdat")
+            ):
+                errors.append("moov after mdat, not streamable.")
+            if self.profile == self.PROFILES.fragmented.name and not info["fragmented"]:
+                errors.append("Not fragmented.")
+            expected = self._track_seconds(track)
+            tolerance = max(
+                self.VERIFY_TOLERANCE, expected * self.VERIFY_TOLERANCE_RATIO
+            )
+            duration = info["duration"]
+            if duration is None:
+                errors.append("No audio track duration.")
+            elif abs(duration - expected) > tolerance:
+                errors.append(f"Duration {duration:.3f}s, expected {expected:.3f}s.")
+            titles = [title for _, title in info["chapters"]]
+            expected_titles = [chapter["title"] for chapter in track["chapters"]]
+            if titles != expected_titles:
+                errors.append(f"Chapters {titles}, expected {expected_titles}.")
+            tags = {
+                "title": track["title"],
+                "album": self.title,
+                "artist": self.author,
+                "track": track["track_no"],
+            }
+            for key, value in tags.items():
+                if value and info["tags"].get(key) != value:
+                    errors.append(
+                        f"Tag {key}: {info['tags'].get(key)!r}, expected {value!r}."
+                    )
+            if self.cover and not info["cover"]:
+                errors.append("No cover.")
+        return {
+            "file": str(track["file"]),
+            "track_no": track["track_no"],
+            "ok": not errors,
+            "errors": errors,
+            "duration": info.get("duration"),
+            "chapters": len(info.get("chapters", [])),
+            "ms": round((time.monotonic() - start) * 1000, 3),
+        }
+
+    def write_seek_index(self) -> list[dict]:
+        """Writes a seek index sidecar next to every output file.
+
+        The sidecar maps the chapters and a time every seek_grid seconds to the byte
+        offsets of their aac frames, see mp4.seek_index(), as compact JSON. Returns
+        the sidecar of every track with its numbers of chapters & points.
+        """
+        results = []
+        with self.report.timed(BOOK, "seek_index"):
+            for track in self.tracks:
+                try:
+                    data = mp4.seek_index(track["file"], self.seek_grid)
+                except (OSError, ValueError, struct.error) as exc:
+                    raise LoggedFileError(
+                        f"Can't index {track['file']}: {exc}", self.lg
+                    ) from exc
+                path = track["file"].with_name(
+                    self.SEEK_INDEX.format(name=track["file"].name)
+                )
+                temp_path = path.with_name(f"{path.name}.tmp")
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, separators=(",", ":"))
+                os.replace(temp_path, path)
+                results.append(
+                    {
+                        "file": str(track["file"]),
+                        "index": str(path),
+                        "chapters": len(data["chapters"]),
+                        "points": len(data["points"]),
+                    }
+                )
+        self.lg.info(f"Wrote the seek index of {len(results)} file(s).")
+        return results
+
+    def _sample_starts(self, duration: float) -> list[float]:
+        # windows spread from the start to the end of the file
+        last = max(duration - self.VERIFY_SAMPLE_SECONDS, 0)
+        if self.VERIFY_SAMPLES < 2 or not last:
+            return [0.0]
+        steps = self.VERIFY_SAMPLES - 1
+        return [last * i / steps for i in range(self.VERIFY_SAMPLES)]
+
+    def _decode_sample(self, item: tuple[dict, float]) -> str | None:
+        # decodes a window of a file, returns the error if it can't be decoded
+        result, start = item
+        cmd = [
+            "ffmpeg", "-xerror", "-ss", f"{start:.3f}",
+            "-t", str(self.VERIFY_SAMPLE_SECONDS), "-i", result["file"],
+            "-map", "0:a", "-f", "null", *self.FF_COMMON_ARGS, "-",
+        ]  # fmt: skip
+        try:
+            self._run_ff(cmd, track_no=result["track_no"], stage="verify_decode")
+        except LoggedFileError as exc:
+            return f"Decode error at {start:.1f}s: {exc}"
+        return None
+
+    def _chapter_seconds(self, chapter: ChapterData) -> float:
+        return sum(self._media_info[file]["duration"] for file in chapter["files"])
+
+    def _track_seconds(self, track: TrackData) -> float:
+        return sum(self._chapter_seconds(chapter) for chapter in track["chapters"])
+
+    def _progress_task(
+        self,
+        track: TrackData,
+        stage: str,
+        duration: float | None = None,
+        weight: float = 1.0,
+    ) -> Callable[[dict], None] | None:
+        # progress callback of one ffmpeg run, covering `weight` of the track's work
+        if not self._progress:
+            return None
+        duration = self._track_seconds(track) if duration is None else duration
+        return self._progress.task(track, stage, duration, weight)
+
+    def _convert_track(self, item: tuple[int, TrackData]) -> None:
+        tr, track = item
+        with self.report.track(track["track_no"], self._track_seconds(track)):
+            self._process_track(tr, track)
+
+    def _process_track(self, tr: int, track: TrackData) -> None:
+        for commands, workers in self._track_steps(tr, track):
+            if len(commands) == 1:
+                self._run_command(commands[0])
+            else:
+                self._run_parallel(self._run_command, commands, workers)
+
+    def _run_command(self, command: FFCommand) -> None:
+        if self._resumed(command):
+            return
+        try:
+            self._run_ff(
+                command["cmd"],
+                command["lg"],
+                command["progress"],
+                command["track_no"],
+                command["stage"],
+            )
+        except LoggedFileError as exc:
+            if not self._use_fallback(command, exc):
+                raise
+            self._run_ff(
+                command["fallback"],
+                command["lg"],
+                command["progress"],
+                command["track_no"],
+                command["stage"],
+            )
+        self._finish_command(command)
+
+    @staticmethod
+    def _use_fallback(command: FFCommand, exc: LoggedFileError) -> bool:
+        # the moov estimate of the streaming profile fell short, see _profile_args
+        if not command["fallback"] or "reserved_moov_size" not in (exc.details or ""):
+            return False
+        command["lg"].warning(
+            "Reserved moov too small, writing it with a faststart pass instead."
+        )
+        return True
+
+    def _resumed(self, command: FFCommand) -> bool:
+        # skips a run whose output was journaled by an interrupted run, see resume
+        if not command["checkpoint"] or not self.checkpoints.is_done(
+            command["checkpoint"], command["output"]
+        ):
+            return False
+        command["lg"].info(f"Resuming, already done: {command['output']}")
+        if command["progress"]:
+            command["progress"]({"progress": "end"})
+        if command["done"]:
+            command["done"]()
+        return True
+
+    def _finish_command(self, command: FFCommand) -> None:
+        # the output gets its final name only once it's complete and on disk, so a
+        # crash never leaves a truncated file that looks done
+        with open(command["partial"], "ab") as f:
+            os.fsync(f.fileno())
+        os.replace(command["partial"], command["output"])
+        if command["checkpoint"]:
+            self.checkpoints.record(command["checkpoint"], command["output"])
+        if command["done"]:
+            command["done"]()
+
+    def _ff_command(
+        self,
+        cmd: list,
+        lg: logging.LoggerAdapter,
+        track: TrackData,
+        stage: str,
+        progress: Callable[[dict], None] | None = None,
+        done: Callable[[], None] | None = None,
+    ) -> FFCommand:
+        # ffmpeg writes to <output>.partial, so the muxer is given explicitly
+        output = Path(cmd[-1])
+        partial = self._temp_file(
+            track, f"{output.name}.partial", output.with_name(f"{output.name}.partial")
+        )
+        muxer = ["-f", self.MUXERS[output.suffix.lower()]]
+        fallback = None
+        if "-moov_size" in cmd:
+            i = cmd.index("-moov_size")
+            fallback = [*cmd[:i], "-movflags", "+faststart", *cmd[i + 2 : -1]]
+            fallback = [*fallback, *muxer, partial]
+        cmd = [*cmd[:-1], *muxer, partial]
+        checkpoint = None
+        if output != track["file"]:  # finished tracks are covered by their manifest
+            inputs = self._input_hashes[track["track_no"]]
+            data = json.dumps([[str(arg) for arg in cmd], inputs])
+            checkpoint = hashlib.sha256(data.encode("utf-8")).hexdigest()
+        return {
+            "cmd": cmd,
+            "lg": lg,
+            "progress": progress,
+            "track_no": track["track_no"],
+            "stage": stage,
+            "done": done,
+            "output": output,
+            "partial": partial,
+            "checkpoint": checkpoint,
+            "fallback": fallback,
+        }
+
+    def _track_steps(self, tr: int, track: TrackData) -> TrackSteps:
+        # The conversion of a track as a sequence of ffmpeg commands, shared by the
+        # sync & async drivers. Every step is a list of commands that may run in
+        # parallel, with its number of workers. The code between the steps only
+        # touches files.
+        lg = PrefixLoggerAdapter(self.lg, {"prefix": f"track {track['track_no']}"})
+        lg.info(f"Processing {track['track_no']}: {track['title']}")
+        manifest = self._track_manifest(track)
+        manifest_path = self._manifest_path(track)
+        old_manifest = self._read_manifest(manifest_path)
+        if old_manifest == manifest:
+            lg.info(f"Track is up to date, skipping: {track['file']}")
+            if self._progress:
+                self._progress.complete(track["track_no"])
+            return
+        manifest_path.unlink(missing_ok=True)
+        # once per track, the manifest stats every input
+        inputs = {k: v for k, v in manifest.items() if k not in ("output", "hls")}
+        data = json.dumps(inputs, sort_keys=True).encode("utf-8")
+        self._input_hashes[track["track_no"]] = hashlib.sha256(data).hexdigest()
+        self._prep_temp_files(track)
+        audio_keys = ("version", "audio", "output")
+        done = "converted"
+
+        def without_hls(data: dict) -> dict:
+            return {key: value for key, value in data.items() if key != "hls"}
+
+        if old_manifest and without_hls(old_manifest) == without_hls(manifest):
+            lg.info(f"The .m4b is up to date, only its HLS changed: {track['file']}")
+            if self._progress:  # cutting HLS is a stream copy, next to no work
+                self._progress.complete(track["track_no"])
+        elif old_manifest and all(
+            old_manifest.get(k) == manifest[k] for k in audio_keys
+        ):
+            yield from self._retag_track(track, lg)
+            done = "retagged"
+        else:
+            yield from self._convert_track_audio(tr, track, lg)
+        if self.hls:
+            # the .m4b is complete, so a crash while cutting HLS only redoes HLS
+            m4b_manifest = self._track_manifest(track)
+            m4b_manifest.pop("hls")
+            self._write_manifest(manifest_path, m4b_manifest)
+            yield from self._hls_track(tr, track, lg)
+        self._write_manifest(manifest_path, self._track_manifest(track))
+        lg.info(f"Track {track['track_no']} {done} successfully.")
+
+    def _convert_track_audio(
+        self, tr: int, track: TrackData, lg: logging.LoggerAdapter
+    ) -> TrackSteps:
+        route = self._track_route(track)
+        if route == "remux":
+            lg.info("Input is a single AAC file within the target bitrate, copying it.")
+            yield from self._convert_track_single_pass(
+                track, lg, audio_args=["-c:a", "copy"], stage="remux"
+            )
+            source = track["chapters"][0]["files"][0]
+            if not self._join_in_sync(track, lg, source):
+                lg.warning("Copied audio differs from the input, re-encoding it.")
+                yield from self._convert_track_single_pass(track, lg)
+        elif route == "segments":
+            yield from self._convert_track_segments(
+                tr, track, lg, self._segment_workers
+            )
+        elif route == self.PIPELINES.single_pass.name:
+            yield from self._convert_track_single_pass(track, lg)
+        else:
+            yield from self._convert_track_two_pass(tr, track, lg)
+
+    def _temp_file(self, track: TrackData, key: str, path: Path) -> Path:
+        # every intermediate is registered before it's written, see remove_temp_files
+        track["temp_files"][key] = path
+        self.temp_files.register(path)
+        return path
+
+    @property
+    def _segment_workers(self) -> int:
+        # jobs left over when there are fewer tracks than jobs go to chapter segments
+        return self.jobs // min(self.jobs, len(self.tracks))
+
+    def _track_route(self, track: TrackData) -> str:
+        # how a track is converted: remux, segments, single_pass or two_pass
+        if self._can_passthrough(track):
+            return "remux"
+        if self.encode_cache or (
+            self.segment_parallel
+            and self._segment_workers > 1
+            and len(track["chapters"]) > 1
+        ):
+            return "segments"
+        return self.pipeline
+
+    def _space_needed(self, track: TrackData) -> tuple[int, int]:
+        # estimated (scratch, output) bytes of a track, from the probed durations
+        files = [file for chapter in track["chapters"] for file in chapter["files"]]
+        input_size = sum(os.path.getsize(file) for file in files)
+        encoded_size = self._track_seconds(track) * int(self.output_bitrate[:-1]) * 125
+        route = self._track_route(track)
+        output = input_size if route == "remux" else encoded_size
+        if self.cover:
+            output += os.path.getsize(self.cover)
+        if self.hls:  # a second copy of the audio
+            output *= 2
+        scratch = 0
+        if route == "segments":
+            scratch = encoded_size
+        elif route == self.PIPELINES.two_pass.name:
+            # the intermediate mp3 is a stream copy of mp3 inputs
+            scratch = input_size if self._input_format == ".mp3" else encoded_size
+        margin = self.SPACE_MARGIN
+        return int(scratch * margin), int(output * margin)
+
+    @staticmethod
+    def _free_space(path: Path) -> tuple[int, int]:
+        # (device, free bytes) of the volume a path is or will be created on
+        while not path.exists() and path.parent != path:
+            path = path.parent
+        return os.stat(path).st_dev, shutil.disk_usage(path).free
+
+    def _check_space(self) -> None:
+        # preflight, fails before any ffmpeg run when a volume can't hold the book.
+        # Intermediates stay until the end of the run, so all tracks count at once.
+        with self.report.timed(BOOK, "preflight"):
+            scratch = output = 0
+            for track in self.tracks:
+                manifest = self._read_manifest(self._manifest_path(track))
+                if manifest == self._track_manifest(track):
+                    continue  # up to date, won't be written
+                track_scratch, track_output = self._space_needed(track)
+                scratch += track_scratch
+                output += track_output
+            sizes = (scratch, output)
+            # scratch & output may share a volume: (paths, bytes needed, bytes free)
+            volumes = {}
+            for path, size in zip((self.scratch_path, self.output_path), sizes):
+                device, free = self._free_space(path)
+                paths, needed, _ = volumes.get(device, ([], 0, free))
+                volumes[device] = ({*paths, str(path)}, needed + size, free)
+        self.lg.debug(f"Estimated space: scratch {scratch} B, output {output} B.")
+        for paths, needed, free in volumes.values():
+            if needed > free:
+                raise LoggedFileError(
+                    f"Not enough space for {', '.join(sorted(paths))}: "
+                    f"{needed / 1024**2:.0f} MiB needed, "
+                    f"{free / 1024**2:.0f} MiB free.",
+                    self.lg,
+                )
+
+    def _retag_track(self, track: TrackData, lg: logging.LoggerAdapter) -> TrackSteps:
+        # only tags, chapters or cover changed: remux the existing audio stream
+        lg.info("Only metadata changed, remuxing without re-encoding.")
+        track_file = track["file"]
+        temp_file = self._temp_file(
+            track,
+            "retag",
+            track_file.with_name(f"{track_file.stem}.retag{self.OUTPUT_TYPE}"),
+        )
+        yield from self._convert_track_single_pass(
+            track,
+            lg,
+            audio_args=["-c:a", "copy"],
+            input_args=["-i", track_file],
+            output_file=temp_file,
+            stage="retag",
+        )
+        os.replace(temp_file, track_file)
+
+    def _manifest_path(self, track: TrackData) -> Path:
+        return track["file"].with_name(f"{track['file'].name}.manifest.json")
+
+    def _track_manifest(self, track: TrackData) -> dict:
+        # everything the content of a track depends on, compared to decide on rebuilds
+        def fingerprint(file: Path) -> dict | None:
+            if not file or not os.path.isfile(file):
+                return None
+            stat = os.stat(file)
+            return {"path": str(file), "size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+        metadata = hashlib.sha256(self._chapter_data(track).encode("utf-8")).hexdigest()
+        manifest = {
+            "version": self.MANIFEST_VERSION,
+            "audio": {
+                "inputs": [
+                    fingerprint(file)
+                    for chapter in track["chapters"]
+                    for file in chapter["files"]
+                ],
+                "encoder": {
+                    "codec": "aac",
+                    "bitrate": self.output_bitrate,
+                    "pipeline": self.pipeline,
+                    "passthrough": self._can_passthrough(track),
+                },
+            },
+            "tags": {"metadata": metadata, "cover": fingerprint(self.cover)},
+            "output": fingerprint(track["file"]),
+        }
+        # only set for other profiles, so existing default outputs stay up to date.
+        # A change remuxes the track, like a change of the tags.
+        if self.profile != self.PROFILES.default.name:
+            manifest["container"] = {
+                "profile": self.profile,
+                "fragment_duration": self.fragment_duration,
+            }
+        if self.hls:
+            manifest["hls"] = {
+                "segment_duration": self.hls_segment_duration,
+                "playlist": fingerprint(self._hls_dir(track) / self.HLS_PLAYLIST),
+            }
+        return manifest
+
+    def _read_manifest(self, manifest_path: Path) -> dict | None:
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def _write_manifest(self, manifest_path: Path, manifest: dict) -> None:
+        temp_path = manifest_path.with_name(f"{manifest_path.name}.tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(temp_path, manifest_path)
+
+    def _can_passthrough(self, track: TrackData) -> bool:
+        # A single aac-lc input can be copied into the m4b as is. Stream copy through
+        # the concat demuxer keeps the priming frames of every file after the first,
+        # which can't be cut between frames, so several inputs are re-encoded.
+        files = [file for chapter in track["chapters"] for file in chapter["files"]]
+        if not self.passthrough or len(files) != 1:
+            return False
+        info = self._media_info[files[0]]
+        max_bitrate = int(self.output_bitrate[:-1]) * 1000
+        max_bitrate *= self.PASSTHROUGH_BITRATE_TOLERANCE
+        return (
+            info["codec"] in self.PASSTHROUGH_CODECS
+            and info["profile"] in self.PASSTHROUGH_PROFILES
+            and 0 < info["bitrate"] <= max_bitrate
+        )
+
+    def _profile_args(self, track: TrackData) -> list[str]:
+        # muxer options of the final .m4b of a track, by profile
+        if self.profile == self.PROFILES.streaming.name:
+            # the moov is written into space reserved before the audio, which saves
+            # the full rewrite of +faststart. If it doesn't fit, _use_fallback does
+            # that rewrite after all.
+            return ["-moov_size", str(self._moov_size(track))]
+        if self.profile == self.PROFILES.fragmented.name:
+            # delay_moov writes the moov once the cover packet is in, so it's kept
+            microseconds = int(self.fragment_duration * 1_000_000)
+            return [
+                "-movflags", "+empty_moov+delay_moov+default_base_moof",
+                "-frag_duration", str(microseconds),
+            ]  # fmt: skip
+        return []
+
+    def _moov_size(self, track: TrackData) -> int:
+        # upper estimate of the moov of a track, from the probed durations
+        sample_rate = max(
+            self._media_info[file]["sample_rate"] or 48000
+            for chapter in track["chapters"]
+            for file in chapter["files"]
+        )
+        seconds = self._track_seconds(track)
+        frames = seconds * sample_rate / 1024  # aac frames, one sample each
+        audio_size = seconds * int(self.output_bitrate[:-1]) * 125
+        chunks = audio_size / 1024**2 + 1
+        titles = sum(len(ch["title"].encode("utf-8")) for ch in track["chapters"])
+        size = (
+            self.MOOV_BASE_SIZE
+            + frames * self.MOOV_FRAME_SIZE
+            + chunks * self.MOOV_CHUNK_SIZE
+            + len(track["chapters"]) * self.MOOV_CHAPTER_SIZE
+            + 2 * titles  # in the chpl box and the chapter text track
+            + (os.path.getsize(self.cover) if self.cover else 0)
+        )
+        return int(size * self.SPACE_MARGIN)
+
+    def _convert_track_single_pass(
+        self,
+        track: TrackData,
+        lg: logging.LoggerAdapter,
+        audio_args: list[str] | None = None,
+        input_args: list | None = None,
+        output_file: Path | None = None,
+        stage: str = "encode",
+        weight: float = 1.0,
+    ) -> TrackSteps:
+        # concat, cover, metadata & chapters and the aac encode in one ffmpeg process
+        audio_args = audio_args or ["-c:a", "aac", "-b:a", self.output_bitrate]
+        input_args = input_args or [
+            "-f", "concat", "-safe", "0", "-i", track["temp_files"]["input_list"]
+        ]  # fmt: skip
+        output_file = output_file or track["file"]
+        cover_args = []
+        if self.cover:
+            cover_args = [
+                "-map", "2:v", "-c:v", "copy", "-disposition:v", "attached_pic",
+                "-metadata:s:v", "title=Cover",
+                "-metadata:s:v", "comment=Cover (front)",
+            ]  # fmt: skip
+        cmd = [
+            "ffmpeg", *input_args, "-i", track["temp_files"]["chapter_data"],
+            *(["-i", self.cover] if self.cover else []),
+            "-map", "0:a", "-map_metadata", "1", "-map_chapters", "1", *cover_args,
+            *audio_args, *self._profile_args(track), *self.FF_COMMON_ARGS, output_file,
+        ]  # fmt: skip
+        lg.debug(f"Converting to m4b in a single pass: {output_file}")
+        progress = self._progress_task(track, stage, weight=weight)
+        yield [self._ff_command(cmd, lg, track, stage, progress)], 1
+
+    def _convert_track_segments(
+        self, tr: int, track: TrackData, lg: logging.LoggerAdapter, workers: int
+    ) -> TrackSteps:
+        # encode every chapter to aac in parallel, then join them by stream copy
+        first = self._media_info[track["chapters"][0]["files"][0]]
+        # same sample rate & channels everywhere, so the segments can be joined
+        settings = {
+            "codec": "aac",
+            "bitrate": self.output_bitrate,
+            "sample_rate": first["sample_rate"],
+            "channels": first["channels"],
+        }
+        # Stream copy can only cut between aac frames, so the segments are cut at the
+        # frame nearest to each chapter end, in samples of the track, and the join
+        # keeps whole frames that neither overlap nor leave gaps. Segments after the
+        # first also start with one frame of pre-roll, which the join skips again:
+        # the priming is spent on it, and the first kept frame decodes like it would
+        # in one continuous stream.
+        frame, rate = self.AAC_FRAME_SAMPLES, settings["sample_rate"]
+        chapters = track["chapters"]
+        ends = list(
+            itertools.accumulate(self._chapter_seconds(chapter) for chapter in chapters)
+        )
+        bounds = [0]
+        for end in ends[:-1]:
+            bounds.append(max(round(end * rate / frame) * frame, bounds[-1] + frame))
+        bounds.append(max(round(ends[-1] * rate), bounds[-1] + 1))
+        preroll = frame / rate
+        segments, pending = [], []
+        for ch, chapter in enumerate(chapters):
+            # samples before the chapter start & past its end, from its neighbours
+            pre = frame if ch else 0
+            lead = (round(ends[ch - 1] * rate) if ch else 0) - bounds[ch] + pre
+            tail = bounds[ch + 1] - round(ends[ch] * rate)
+            length = bounds[ch + 1] - bounds[ch] + pre
+            files = list(chapter["files"])
+            inpoint = outpoint = 0.0
+            if lead > 0:
+                files.insert(0, chapters[ch - 1]["files"][-1])
+                inpoint = max(self._media_info[files[0]]["duration"] - lead / rate, 0.0)
+            if tail > 0:
+                files.append(chapters[ch + 1]["files"][0])
+                outpoint = (tail + frame) / rate  # atrim does the exact cut
+            key = ""
+            if self.encode_cache:
+                key = self.encode_cache.key(
+                    [self.encode_cache.content_hash(file) for file in files],
+                    settings | {"span": [lead, length]},
+                )
+                if cached := self.encode_cache.get(key):
+                    segments.append(cached)
+                    duration = self._chapter_seconds(chapter)
+                    if progress := self._progress_task(track, f"ch {ch + 1}", duration):
+                        progress({"progress": "end"})
+                    continue
+            input_list = self._temp_file(
+                track,
+                f"chapter_{ch + 1}_input_list",
+                self.scratch_path / f"track_{tr + 1}_chapter_{ch + 1}_files.txt",
+            )
+            self._write_input_list(input_list, files, inpoint, outpoint)
+            segment = self._temp_file(
+                track,
+                f"segment_{ch + 1}",
+                self.scratch_path / f"track_{tr + 1}_segment_{ch + 1}.m4a",
+            )
+            segments.append(segment)
+            pending.append((ch, input_list, segment, key, length))
+        lg.debug(
+            f"Encoding {len(pending)}/{len(segments)} chapter segments "
+            f"({len(segments) - len(pending)} cached), {workers} jobs."
+        )
+
+        def encode(
+            ch: int, input_list: Path, segment: Path, key: str, length: int
+        ) -> FFCommand:
+            # atrim cuts the decoded samples exactly, from the inpoint to the end
+            cmd = [
+                "ffmpeg", "-f", "concat", "-safe", "0", "-i", input_list,
+                "-map", "0:a", "-af", f"atrim=start=0:end={length / rate:.6f}",
+                "-c:a", "aac", "-b:a", self.output_bitrate,
+                "-ar", str(rate), "-ac", str(settings["channels"]),
+                *self.FF_COMMON_ARGS, segment,
+            ]  # fmt: skip
+            duration = self._chapter_seconds(track["chapters"][ch])
+            progress = self._progress_task(track, f"ch {ch + 1}", duration)
+
+            def done() -> None:
+                segments[ch] = self.encode_cache.put(key, segment)
+
+            return self._ff_command(
+                cmd, lg, track, "segment", progress, done if self.encode_cache else None
+            )
+
+        if pending:
+            yield [encode(*item) for item in pending], workers
+
+        # The encoder delay of the first segment is hidden by the edit list of the
+        # output. Stream copy keeps the priming packets of the others though, so they
+        # start at the frame after the pre-roll. "duration" pins each segment to its
+        # frame-aligned length, and "outpoint", half a frame before the end of the
+        # frames that hold audio, drops the encoder padding after them.
+        segment_list = self._temp_file(
+            track, "segment_list", self.scratch_path / f"track_{tr + 1}_segments.txt"
+        )
+        with open(segment_list, "w", encoding="utf-8") as f:
+            for ch, segment in enumerate(segments):
+                samples = bounds[ch + 1] - bounds[ch]
+                inpoint = preroll if ch else 0.0
+                outpoint = inpoint + (math.ceil(samples / frame) - 0.5) * frame / rate
+                f.write(f"file '{self._escape_concat_path(segment)}'\n")
+                if inpoint:
+                    f.write(f"inpoint {inpoint:.6f}\n")
+                f.write(f"duration {samples / rate:.6f}\noutpoint {outpoint:.6f}\n")
+        lg.debug(f"Joining {len(segments)} chapter segments: {track['file']}")
+        yield from self._convert_track_single_pass(
+            track,
+            lg,
+            audio_args=["-c:a", "copy"],
+            input_args=["-f", "concat", "-safe", "0", "-i", segment_list],
+            stage="join",
+            weight=0.0,
+        )
+        if not self._join_in_sync(track, lg):
+            lg.warning("Joined segments are out of sync, re-encoding the whole track.")
+            yield from self._convert_track_single_pass(track, lg)
+
+    def _join_in_sync(
+        self, track: TrackData, lg: logging.LoggerAdapter, source: Path | None = None
+    ) -> bool:
+        # Decoders output every kept frame in full, so a priming, pre-roll or
+        # overlapping frame that survived the join adds up to a frame per chapter.
+        # Only the last frame may run past the end of the audio. A remux must decode
+        # to exactly the samples of its source.
+        try:
+            decoded = mp4.decoded_samples(track["file"], self.AAC_FRAME_SAMPLES)
+            if source:
+                expected = mp4.decoded_samples(source, self.AAC_FRAME_SAMPLES)
+        except (OSError, ValueError, struct.error) as exc:
+            lg.debug(f"Can't read the joined track: {exc}")
+            return False
+        if decoded is None:
+            return False
+        if source:
+            lg.debug(f"Remuxed track: {decoded} samples decoded, {expected} in input.")
+            return decoded == expected
+        sample_rate, samples = decoded
+        expected = round(self._track_seconds(track) * sample_rate)
+        lg.debug(f"Joined track: {samples} samples decoded, {expected} expected.")
+        return abs(samples - expected) < self.AAC_FRAME_SAMPLES
+
+    def _hls_dir(self, track: TrackData) -> Path:
+        return track["file"].with_name(self.HLS_DIR.format(stem=track["file"].stem))
+
+    def _hls_track(
+        self, tr: int, track: TrackData, lg: logging.LoggerAdapter
+    ) -> TrackSteps:
+        # HLS by stream copy of the .m4b: every chapter is cut into fMP4 segments by
+        # its own ffmpeg run, so segments never straddle a chapter START, then the
+        # chapter playlists are joined into one with a discontinuity per chapter
+        hls_dir = self._hls_dir(track)
+        hls_dir.mkdir(parents=True, exist_ok=True)
+        if not self.resume:  # segments of another chapter layout
+            for stale in hls_dir.glob("chapter_*"):
+                stale.unlink()
+        (hls_dir / self.HLS_PLAYLIST).unlink(missing_ok=True)
+        starts = [start for start, _ in self._chapter_times(track)]
+        commands = []
+        for ch, start in enumerate(starts):
+            name = f"chapter_{ch + 1}"
+            playlist = self._temp_file(track, f"hls_{ch + 1}", hls_dir / f"{name}.m3u8")
+            cut = ["-t", str(starts[ch + 1] - start)] if ch + 1 < len(starts) else []
+            cmd = [
+                "ffmpeg", "-ss", str(start), *cut, "-i", track["file"],
+                "-map", "0:a", "-c", "copy",
+                "-hls_time", str(self.hls_segment_duration),
+                "-hls_playlist_type", "vod", "-hls_segment_type", "fmp4",
+                "-hls_flags", "independent_segments",
+                "-hls_fmp4_init_filename", f"{name}_init.mp4",
+                "-hls_segment_filename", hls_dir / f"{name}_%05d.m4s",
+                *self.FF_COMMON_ARGS, playlist,
+            ]  # fmt: skip
+            commands.append(self._ff_command(cmd, lg, track, "hls"))
+        lg.debug(f"Cutting {len(commands)} chapter(s) into HLS segments: {hls_dir}")
+        yield commands, self._segment_workers
+        self._write_hls_playlist(track, hls_dir, [c["output"] for c in commands])
+
+    def _write_hls_playlist(
+        self, track: TrackData, hls_dir: Path, playlists: list[Path]
+    ) -> None:
+        # chapters run from their START to the next one, like their segments
+        lines, segments, chapters = [], 0, []
+        target = self.hls_segment_duration
+        starts = [start for start, _ in self._chapter_times(track)]
+        ends = [*starts[1:], round(self._track_seconds(track), 3)]
+        for ch, (chapter, playlist) in enumerate(zip(track["chapters"], playlists)):
+            chapter_lines = playlist.read_text(encoding="utf-8").splitlines()
+            init = next(line for line in chapter_lines if line.startswith("#EXT-X-MAP"))
+            chapters.append(
+                {
+                    "title": chapter["title"],
+                    "start": starts[ch],
+                    "end": ends[ch],
+                    "segment": segments,  # index of its first segment
+                }
+            )
+            lines += ["#EXT-X-DISCONTINUITY"] if ch else []
+            lines.append(init)
+            for line, uri in zip(chapter_lines, chapter_lines[1:]):
+                if line.startswith("#EXTINF:"):
+                    target = max(target, float(line[8:].split(",")[0]))
+                    lines += [line, uri]
+                    segments += 1
+        header = [
+            "#EXTM3U", "#EXT-X-VERSION:7", f"#EXT-X-TARGETDURATION:{math.ceil(target)}",
+            "#EXT-X-MEDIA-SEQUENCE:0", "#EXT-X-PLAYLIST-TYPE:VOD",
+            "#EXT-X-INDEPENDENT-SEGMENTS",
+        ]  # fmt: skip
+        sidecar = {
+            "title": track["title"],
+            "track_no": track["track_no"],
+            "playlist": self.HLS_PLAYLIST,
+            "segments": segments,
+            "chapters": chapters,
+        }
+        # the playlist goes last, it marks the HLS output as complete
+        self._write_manifest(hls_dir / self.HLS_CHAPTERS, sidecar)
+        temp_path = hls_dir / f"{self.HLS_PLAYLIST}.tmp"
+        temp_path.write_text(
+            "\n".join([*header, *lines, "#EXT-X-ENDLIST"]) + "\n", encoding="utf-8"
+        )
+        os.replace(temp_path, hls_dir / self.HLS_PLAYLIST)
+
+    def _convert_track_two_pass(
+        self, tr: int, track: TrackData, lg: logging.LoggerAdapter
+    ) -> TrackSteps:
         if self._input_format == ".mp3":
             codec_args = ["-c", "copy"]
         else:
@@ -318,30 +1919,27 @@ class M4BMaker:
                 "-metadata:s:v", "comment=Cover (front)", "-map", "1"
             ]  # fmt: skip
 
-        for track in self.tracks:
-            self.lg.info(f"Processing {track['track_no']}: {track['title']}")
-            track_file = track["file"]
-            if os.path.exists(track_file):
-                continue
-            temp_file = track_file.with_stem(track_file.stem + "_t").with_suffix(".mp3")
-            track["temp_files"]["temp"] = temp_file
-
-            cmd1 = [  # Step 1: Concatenate input files into a single mp3 and add cover
-                "ffmpeg", "-f", "concat", "-safe", "0", 
-                "-i", track["temp_files"]["input_list"], *cover_args, "-map", "0:a",
-                *codec_args, *common_args, track["temp_files"]["temp"],
-            ]  # fmt: skip
-            cmd2 = [  # Step 2: Convert mp3 to m4b and add metadata
-                "ffmpeg", "-i", track["temp_files"]["temp"],
-                "-i", track["temp_files"]["chapter_data"],
-                "-map_metadata", "1", "-c", "copy", "-c:a", "aac", "-b:a",
-                self.output_bitrate, *common_args, track["file"],
-            ]  # fmt: skip
-            self.lg.debug(f"Step 1: Concatenating input files: {temp_file}")
-            self._run_ff(cmd1)
-            self.lg.debug(f"Step 2: Converting to m4b: {track_file}")
-            self._run_ff(cmd2)
-            self.lg.info(f"Track {track['track_no']} converted successfully.")
+        track_file = track["file"]
+        # temp files are named after the track index, so concurrent tracks never clash
+        temp_file = self._temp_file(
+            track, "temp", self.scratch_path / f"track_{tr + 1}_temp.mp3"
+        )
 
-        self.remove_temp_files()
-        self.lg.info(f"All done! Get your new audiobook from: {self.output_path}")
+        cmd1 = [  # Step 1: Concatenate input files into a single mp3 and add cover
+            "ffmpeg", "-f", "concat", "-safe", "0", 
+            "-i", track["temp_files"]["input_list"], *cover_args, "-map", "0:a",
+            *codec_args, *self.FF_COMMON_ARGS, track["temp_files"]["temp"],
+        ]  # fmt: skip
+        cmd2 = [  # Step 2: Convert mp3 to m4b and add metadata
+            "ffmpeg", "-i", track["temp_files"]["temp"],
+            "-i", track["temp_files"]["chapter_data"],
+            "-map_metadata", "1", "-c", "copy", "-c:a", "aac", "-b:a",
+            self.output_bitrate, *self._profile_args(track), *self.FF_COMMON_ARGS,
+            track["file"],
+        ]  # fmt: skip
+        lg.debug(f"Step 1: Concatenating input files: {temp_file}")
+        progress = self._progress_task(track, "concat", weight=0.5)
+        yield [self._ff_command(cmd1, lg, track, "concat", progress)], 1
+        lg.debug(f"Step 2: Converting to m4b: {track_file}")
+        progress = self._progress_task(track, "encode", weight=0.5)
+        yield [self._ff_command(cmd2, lg, track, "encode", progress)], 1
@@ -0,0 +1,482 @@
+import mmap
+import struct
+from bisect import bisect_right
+from pathlib import Path
+
+# iTunes metadata items of the ilst box, by the names of the ffmetadata keys
+ILST_TAGS = {
+    b"\xa9nam": "title", b"\xa9ART": "artist", b"aART": "album_artist",
+    b"\xa9alb": "album", b"\xa9wrt": "composer", b"\xa9gen": "genre",
+    b"\xa9day": "date", b"trkn": "track", b"disk": "disc",
+}  # fmt: skip
+
+
+def iter_boxes(buf, start: int, end: int):
+    """Yields (type, payload start, box end) for every ISO-BMFF box in a range."""
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", buf, pos)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", buf, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise ValueError(f"Corrupt box {kind!r} at offset {pos}")
+        yield kind, pos + header, pos + size
+        pos += size
+
+
+def find_box(buf, start: int, end: int, *path: bytes) -> tuple[int, int] | None:
+    """Returns the (payload start, box end) of the first box matching a type path."""
+    for kind, payload, box_end in iter_boxes(buf, start, end):
+        if kind == path[0]:
+            if len(path) == 1:
+                return payload, box_end
+            return find_box(buf, payload, box_end, *path[1:])
+    return None
+
+
+def media_header(buf, mdhd: tuple[int, int]) -> tuple[int, int]:
+    """Returns (timescale, duration) from an mdhd or mvhd box payload."""
+    if buf[mdhd[0]] == 1:
+        return struct.unpack_from(">IQ", buf, mdhd[0] + 20)
+    return struct.unpack_from(">II", buf, mdhd[0] + 12)
+
+
+def handler_type(buf, mdia: tuple[int, int]) -> bytes:
+    hdlr = find_box(buf, *mdia, b"hdlr")
+    return bytes(buf[hdlr[0] + 8 : hdlr[0] + 12]) if hdlr else b""
+
+
+def edited_duration(
+    buf, moov: tuple[int, int], trak: tuple[int, int], timescale: int, length: int
+) -> float:
+    """Returns the duration of a track in seconds as played, after its edit list.
+
+    Encoders hide the priming samples before the audio, and the padding after it,
+    with an elst entry, and decoders like the concat demuxer drop them. Empty edits
+    are skipped. Without an edit list, it's the media duration of the mdhd.
+    """
+    media = length / timescale
+    elst = find_box(buf, *trak, b"edts", b"elst")
+    if not elst:
+        return media
+    mvhd = find_box(buf, *moov, b"mvhd")
+    movie_timescale = media_header(buf, mvhd)[0] if mvhd else 0
+    entry_format, stride = (">Qq", 20) if buf[elst[0]] == 1 else (">Ii", 12)
+    total = 0.0
+    for i in range(struct.unpack_from(">I", buf, elst[0] + 4)[0]):
+        entry = elst[0] + 8 + i * stride
+        segment, media_time = struct.unpack_from(entry_format, buf, entry)
+        if media_time < 0:  # empty edit
+            continue
+        if segment and movie_timescale:
+            total += segment / movie_timescale
+        else:  # no segment duration, e.g. fragmented: the rest of the media
+            total += max(length - media_time, 0) / timescale
+    return total or media
+
+
+def _priming(buf, trak: tuple[int, int]) -> int:
+    # media time of the first non-empty edit, the samples the decoder skips
+    elst = find_box(buf, *trak, b"edts", b"elst")
+    if not elst:
+        return 0
+    entry_format, stride = (">Qq", 20) if buf[elst[0]] == 1 else (">Ii", 12)
+    for i in range(struct.unpack_from(">I", buf, elst[0] + 4)[0]):
+        entry = elst[0] + 8 + i * stride
+        media_time = struct.unpack_from(entry_format, buf, entry)[1]
+        if media_time >= 0:
+            return media_time
+    return 0
+
+
+def decoded_samples(path: Path, frame_samples: int) -> tuple[int, int] | None:
+    """Returns (sample rate, samples) that a decoder outputs for the sound track.
+
+    Every frame is decoded in full, less the priming skipped by the edit list. Unlike
+    the edited duration, that counts frames past the end of the edit and frames
+    whose timestamps overlap. None when there's no sound track.
+    """
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            moov = find_box(mm, 0, len(mm), b"moov")
+            found = moov and audio_track(mm, moov)
+            if not found:
+                return None
+            trak, mdia = found
+            mdhd = find_box(mm, *mdia, b"mdhd")
+            stbl = find_box(mm, *mdia, b"minf", b"stbl")
+            stsd = stbl and find_box(mm, *stbl, b"stsd")
+            entry = stsd and next(iter_boxes(mm, stsd[0] + 8, stsd[1]), None)
+            timescale = media_header(mm, mdhd)[0] if mdhd else 0
+            if not entry or not timescale:
+                return None
+            rate = struct.unpack_from(">I", mm, entry[1] + 24)[0] >> 16
+            frames = 0
+            if stsz := find_box(mm, *stbl, b"stsz"):
+                frames = struct.unpack_from(">I", mm, stsz[0] + 8)[0]
+            frames += _fragment_samples(mm, len(mm), track_id(mm, trak))
+            priming = _priming(mm, trak) * rate // timescale
+            return rate, frames * frame_samples - priming
+
+
+def _fragment_samples(buf, size: int, track: int | None) -> int:
+    # samples of a track in the trun boxes of all fragments
+    count = 0
+    for kind, moof, moof_end in iter_boxes(buf, 0, size):
+        if kind != b"moof":
+            continue
+        for kind, traf, traf_end in iter_boxes(buf, moof, moof_end):
+            tfhd = kind == b"traf" and find_box(buf, traf, traf_end, b"tfhd")
+            if not tfhd or struct.unpack_from(">I", buf, tfhd[0] + 4)[0] != track:
+                continue
+            for kind, trun, _ in iter_boxes(buf, traf, traf_end):
+                if kind == b"trun":
+                    count += struct.unpack_from(">I", buf, trun + 4)[0]
+    return count
+
+
+def track_id(buf, trak: tuple[int, int]) -> int | None:
+    tkhd = find_box(buf, *trak, b"tkhd")
+    if not tkhd:
+        return None
+    return struct.unpack_from(">I", buf, tkhd[0] + (20 if buf[tkhd[0]] == 1 else 12))[0]
+
+
+def audio_track(buf, moov: tuple[int, int]) -> tuple[tuple[int, int], ...] | None:
+    """Returns the (trak, mdia) ranges of the first sound track of a moov."""
+    for kind, trak, trak_end in iter_boxes(buf, *moov):
+        mdia = kind == b"trak" and find_box(buf, trak, trak_end, b"mdia")
+        if mdia and handler_type(buf, mdia) == b"soun":
+            return (trak, trak_end), mdia
+    return None
+
+
+def fragments(
+    buf, size: int, moov: tuple[int, int], track: int
+) -> list[tuple[int, int, int]]:
+    """Returns (moof offset, start, duration) of the fragments of a track.
+
+    Times are in the track timescale, summed from the sample durations of the trun
+    boxes, falling back to the defaults of the tfhd and then the trex of the track.
+    """
+    default = 0
+    if mvex := find_box(buf, *moov, b"mvex"):
+        for kind, payload, _ in iter_boxes(buf, *mvex):
+            if kind != b"trex":
+                continue
+            trex_track, _, duration = struct.unpack_from(">III", buf, payload + 4)
+            if trex_track == track:
+                default = duration
+    result, time = [], 0
+    for kind, moof, moof_end in iter_boxes(buf, 0, size):
+        if kind != b"moof":
+            continue
+        fragment = 0
+        for kind, traf, traf_end in iter_boxes(buf, moof, moof_end):
+            tfhd = kind == b"traf" and find_box(buf, traf, traf_end, b"tfhd")
+            if not tfhd:
+                continue
+            flags, tfhd_track = struct.unpack_from(">II", buf, tfhd[0])
+            if tfhd_track != track:
+                continue
+            duration, pos = default, tfhd[0] + 8
+            pos += 8 if flags & 0x01 else 0  # base data offset
+            pos += 4 if flags & 0x02 else 0  # sample description index
+            if flags & 0x08:
+                duration = struct.unpack_from(">I", buf, pos)[0]
+            for kind, trun, _ in iter_boxes(buf, traf, traf_end):
+                if kind == b"trun":
+                    fragment += _trun_duration(buf, trun, duration)
+        if fragment:
+            result.append((moof - 8, time, fragment))  # offset of the box header
+            time += fragment
+    return result
+
+
+def _trun_duration(buf, trun: int, default: int) -> int:
+    flags, count = struct.unpack_from(">II", buf, trun)
+    flags &= 0xFFFFFF
+    if not flags & 0x100:
+        return count * default
+    pos = trun + 8
+    pos += 4 if flags & 0x01 else 0  # data offset
+    pos += 4 if flags & 0x04 else 0  # first sample flags
+    # per sample: duration, size, flags & composition offset, when present
+    stride = 4 * bin(flags & 0xF00).count("1")
+    return sum(
+        struct.unpack_from(">I", buf, pos + i * stride)[0] for i in range(count)
+    )
+
+
+def _chunk_offsets(buf, stbl: tuple[int, int]) -> tuple[int, ...]:
+    if stco := find_box(buf, *stbl, b"stco"):
+        chunks = struct.unpack_from(">I", buf, stco[0] + 4)[0]
+        return struct.unpack_from(f">{chunks}I", buf, stco[0] + 8)
+    if co64 := find_box(buf, *stbl, b"co64"):
+        chunks = struct.unpack_from(">I", buf, co64[0] + 4)[0]
+        return struct.unpack_from(f">{chunks}Q", buf, co64[0] + 8)
+    return ()
+
+
+def _chunk_runs(buf, stsc: tuple[int, int]) -> list[tuple[int, int]]:
+    # (first chunk, samples per chunk), each run lasts until the next one
+    entries = struct.unpack_from(">I", buf, stsc[0] + 4)[0]
+    return [
+        struct.unpack_from(">II", buf, stsc[0] + 8 + i * 12) for i in range(entries)
+    ]
+
+
+def _sample_sizes(buf, stsz: tuple[int, int], first: int, last: int) -> list[int]:
+    # sizes of the samples first to last - 1
+    size, count = struct.unpack_from(">II", buf, stsz[0] + 4)
+    last = min(last, count)
+    if size:
+        return [size] * (last - first)
+    return list(struct.unpack_from(f">{last - first}I", buf, stsz[0] + 12 + first * 4))
+
+
+def sample_ranges(buf, stbl: tuple[int, int]) -> list[tuple[int, int]]:
+    """Returns the (file offset, size) of every sample of a track, from its stbl."""
+    stsz = find_box(buf, *stbl, b"stsz")
+    stsc = find_box(buf, *stbl, b"stsc")
+    offsets = _chunk_offsets(buf, stbl)
+    if not stsz or not stsc or not offsets:
+        return []
+    count = struct.unpack_from(">I", buf, stsz[0] + 8)[0]
+    sizes = _sample_sizes(buf, stsz, 0, count)
+    chunks = len(offsets)
+    runs = _chunk_runs(buf, stsc)
+    ranges, sample = [], 0
+    for i, (first, per_chunk) in enumerate(runs):
+        last = runs[i + 1][0] - 1 if i + 1 < len(runs) else chunks
+        for chunk in range(first - 1, last):
+            offset = offsets[chunk]
+            for size in sizes[sample : sample + per_chunk]:
+                ranges.append((offset, size))
+                offset += size
+            sample += per_chunk
+    return ranges[:count]
+
+
+def seek_points(
+    buf, stbl: tuple[int, int], times: list[int]
+) -> list[tuple[int, int]]:
+    """Returns the (decode time, file offset) of the sample playing at each time.
+
+    Times are in the track timescale. The stts & stsc runs are searched with bisect
+    and stsz is only read within the chunks that are hit, so no table is expanded
+    per sample, which matters for the millions of aac frames of a long book.
+    """
+    stts = find_box(buf, *stbl, b"stts")
+    stsz = find_box(buf, *stbl, b"stsz")
+    stsc = find_box(buf, *stbl, b"stsc")
+    offsets = _chunk_offsets(buf, stbl)
+    if not stts or not stsz or not stsc or not offsets:
+        return []
+    count = struct.unpack_from(">I", buf, stsz[0] + 8)[0]
+    # stts runs as (first sample, first time, delta)
+    time_runs, sample, time = [], 0, 0
+    entries = struct.unpack_from(">I", buf, stts[0] + 4)[0]
+    for entry in range(entries):
+        samples, delta = struct.unpack_from(">II", buf, stts[0] + 8 + entry * 8)
+        time_runs.append((sample, time, delta))
+        sample += samples
+        time += samples * delta
+    # stsc runs as (first sample, first chunk index, samples per chunk)
+    chunk_runs, sample = [], 0
+    runs = _chunk_runs(buf, stsc)
+    for i, (first, per_chunk) in enumerate(runs):
+        last = runs[i + 1][0] - 1 if i + 1 < len(runs) else len(offsets)
+        chunk_runs.append((sample, first - 1, per_chunk))
+        sample += (last - first + 1) * per_chunk
+    run_times = [run[1] for run in time_runs]
+    run_samples = [run[0] for run in chunk_runs]
+    points = []
+    for target in times:
+        first, start, delta = time_runs[max(bisect_right(run_times, target) - 1, 0)]
+        sample = min(first + (target - start) // delta if delta else first, count - 1)
+        decode_time = start + (sample - first) * delta
+        first, chunk, per_chunk = chunk_runs[bisect_right(run_samples, sample) - 1]
+        chunk += (sample - first) // per_chunk
+        chunk_first = sample - (sample - first) % per_chunk
+        offset = offsets[chunk] + sum(_sample_sizes(buf, stsz, chunk_first, sample))
+        points.append((decode_time, offset))
+    return points
+
+
+def sample_times(buf, stbl: tuple[int, int]) -> list[int]:
+    """Returns the decode time of every sample of a track, in its timescale."""
+    stts = find_box(buf, *stbl, b"stts")
+    if not stts:
+        return []
+    entries = struct.unpack_from(">I", buf, stts[0] + 4)[0]
+    times, time = [], 0
+    for entry in range(entries):
+        count, delta = struct.unpack_from(">II", buf, stts[0] + 8 + entry * 8)
+        times.extend(time + i * delta for i in range(count))
+        time += count * delta
+    return times
+
+
+def _read_chpl(buf, chpl: tuple[int, int]) -> list[tuple[float, str]]:
+    # Nero chapters: start in 100 ns units and a length-prefixed title per chapter
+    pos = chpl[0] + (8 if buf[chpl[0]] == 1 else 4)
+    chapters = []
+    count, pos = buf[pos], pos + 1
+    for _ in range(count):
+        start, length = struct.unpack_from(">QB", buf, pos)
+        title = bytes(buf[pos + 9 : pos + 9 + length]).decode("utf-8", "replace")
+        chapters.append((start / 10_000_000, title))
+        pos += 9 + length
+    return chapters
+
+
+def _read_text_track(buf, mdia: tuple[int, int]) -> list[tuple[float, str]]:
+    # QuickTime chapter track: every sample is a 16-bit length and the title
+    mdhd = find_box(buf, *mdia, b"mdhd")
+    stbl = find_box(buf, *mdia, b"minf", b"stbl")
+    if not mdhd or not stbl:
+        return []
+    timescale, _ = media_header(buf, mdhd)
+    chapters = []
+    for time, (offset, size) in zip(sample_times(buf, stbl), sample_ranges(buf, stbl)):
+        length = struct.unpack_from(">H", buf, offset)[0] if size >= 2 else 0
+        title = bytes(buf[offset + 2 : offset + 2 + min(length, size - 2)])
+        chapters.append((time / timescale, title.decode("utf-8", "replace")))
+    return chapters
+
+
+def _read_ilst(buf, ilst: tuple[int, int]) -> tuple[dict[str, str], bool]:
+    tags, cover = {}, False
+    for kind, payload, end in iter_boxes(buf, *ilst):
+        data = find_box(buf, payload, end, b"data")
+        if not data:
+            continue
+        value = bytes(buf[data[0] + 8 : data[1]])
+        if kind == b"covr":
+            cover = bool(value)
+        elif kind in (b"trkn", b"disk") and len(value) >= 6:
+            number, total = struct.unpack_from(">HH", value, 2)
+            tags[ILST_TAGS[kind]] = f"{number}/{total}" if total else str(number)
+        elif kind in ILST_TAGS:
+            tags[ILST_TAGS[kind]] = value.decode("utf-8", "replace")
+    return tags, cover
+
+
+def read_structure(path: Path) -> dict:
+    """Reads the structure of an .m4b/.m4a file without decoding it.
+
+    Returns the top level box types, the duration of the audio track in seconds,
+    the chapters as (start seconds, title), the iTunes tags, whether there is a
+    cover and whether the audio is fragmented. Raises ValueError or struct.error
+    when the boxes are corrupt.
+    """
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _read_structure(mm)
+
+
+def _read_structure(mm: mmap.mmap) -> dict:
+    info = {
+        "boxes": [], "duration": None, "chapters": [], "tags": {}, "cover": False,
+        "fragmented": False,
+    }  # fmt: skip
+    size = len(mm)
+    info["boxes"] = [kind.decode("latin-1") for kind, _, _ in iter_boxes(mm, 0, size)]
+    moov = find_box(mm, 0, size, b"moov")
+    if not moov:
+        return info
+    text_track = None
+    for kind, trak, trak_end in iter_boxes(mm, *moov):
+        mdia = kind == b"trak" and find_box(mm, trak, trak_end, b"mdia")
+        if not mdia:
+            continue
+        handler = handler_type(mm, mdia)
+        if handler == b"soun" and info["duration"] is None:
+            mdhd = find_box(mm, *mdia, b"mdhd")
+            timescale, duration = media_header(mm, mdhd) if mdhd else (0, 0)
+            if "moof" in info["boxes"]:  # the moov holds no samples
+                info["fragmented"] = True
+                track = track_id(mm, (trak, trak_end))
+                fragmented = fragments(mm, size, moov, track)
+                duration += sum(length for _, _, length in fragmented)
+            info["duration"] = None
+            if timescale and info["fragmented"]:
+                info["duration"] = duration / timescale
+            elif timescale:
+                info["duration"] = edited_duration(
+                    mm, moov, (trak, trak_end), timescale, duration
+                )
+        elif handler == b"text":
+            text_track = mdia
+        elif handler == b"vide":  # cover stored as an attached picture
+            info["cover"] = True
+    if chpl := find_box(mm, *moov, b"udta", b"chpl"):
+        info["chapters"] = _read_chpl(mm, chpl)
+    elif text_track:
+        info["chapters"] = _read_text_track(mm, text_track)
+    if meta := find_box(mm, *moov, b"udta", b"meta"):
+        start = meta[0]
+        if mm[start + 4 : start + 8] != b"hdlr":  # full box: version & flags
+            start += 4
+        if ilst := find_box(mm, start, meta[1], b"ilst"):
+            info["tags"], cover = _read_ilst(mm, ilst)
+            info["cover"] = info["cover"] or cover
+    return info
+
+
+def seek_index(path: Path, grid: float) -> dict:
+    """Maps the chapters of a file, and a time every `grid` seconds, to byte offsets.
+
+    Each point is the (time, offset) of the aac frame playing at that time, from the
+    sample tables, or of the moof of the fragment for fragmented files, so a player
+    can seek with a single range request once it has the moov. Times are seconds.
+    """
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = len(mm)
+            info = _read_structure(mm)
+            moov = find_box(mm, 0, size, b"moov")
+            track = moov and audio_track(mm, moov)
+            if not track or not info["duration"]:
+                raise ValueError("No audio track.")
+            trak, mdia = track
+            timescale, _ = media_header(mm, find_box(mm, *mdia, b"mdhd"))
+            grid_times = [i * grid for i in range(int(info["duration"] // grid) + 1)]
+            starts = [start for start, _ in info["chapters"]]
+            times = [round(t * timescale) for t in [*starts, *grid_times]]
+            if info["fragmented"]:
+                runs = fragments(mm, size, moov, track_id(mm, trak))
+                run_times = [start for _, start, _ in runs]
+                points = []
+                for time in times:
+                    offset, start, _ = runs[max(bisect_right(run_times, time) - 1, 0)]
+                    points.append((start, offset))
+            else:
+                stbl = find_box(mm, *mdia, b"minf", b"stbl")
+                points = seek_points(mm, stbl, times) if stbl else []
+            box_start = 0  # of the moov header, a client fetches the moov first
+            for kind, _, box_end in iter_boxes(mm, 0, size):
+                if kind == b"moov":
+                    break
+                box_start = box_end
+    if len(points) != len(times):
+        raise ValueError("No sample tables.")
+    points = [(round(time / timescale, 3), offset) for time, offset in points]
+    return {
+        "version": 1,
+        "size": size,
+        "duration": round(info["duration"], 3),
+        "fragmented": info["fragmented"],
+        "moov": [box_start, moov[1] - box_start],
+        "chapters": [
+            [title, round(start, 3), *point]
+            for (start, title), point in zip(info["chapters"], points)
+        ],
+        "grid": grid,
+        "points": [list(point) for point in points[len(starts) :]],
+    }
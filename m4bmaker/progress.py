@@ -0,0 +1,107 @@
+import sys
+import threading
+import time
+from typing import Callable
+
+from m4bmaker.types import ProgressEvent
+
+
+def parse_speed(value: str) -> float:
+    """Parses ffmpeg's speed value, e.g. '12.3x'."""
+    try:
+        return float(value.strip().rstrip("x"))
+    except ValueError:
+        return 0.0
+
+
+def format_seconds(seconds: float | None) -> str:
+    if seconds is None:
+        return "--:--:--"
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class ProgressTracker:
+    """Turns ffmpeg -progress blocks into per-track and per-book progress events.
+
+    Every ffmpeg run of a track is a task covering `duration` seconds of audio and
+    `weight` of the track's work, e.g. 0.5 for each step of the two-pass pipeline.
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[ProgressEvent], None],
+        track_durations: dict[str, float],
+    ) -> None:
+        self.callback = callback
+        self.track_durations = track_durations
+        self.book_duration = sum(track_durations.values())
+        self.started = time.monotonic()
+        self._done: dict[tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+
+    def complete(self, track_no: str) -> None:
+        """Marks a track that needs no work, e.g. an up-to-date one, as done."""
+        with self._lock:
+            self._done[(track_no, "")] = self.track_durations[track_no]
+
+    def task(
+        self, track: dict, stage: str, duration: float, weight: float = 1.0
+    ) -> Callable[[dict], None]:
+        """Returns the callback for the ffmpeg progress blocks of one task."""
+
+        def update(block: dict) -> None:
+            if block.get("progress") == "end":
+                seconds = duration
+            else:
+                try:
+                    seconds = min(int(block.get("out_time_us", 0)) / 1e6, duration)
+                except ValueError:  # "N/A" before the first packet
+                    seconds = 0.0
+            self._update(track, stage, seconds * weight, block)
+
+        return update
+
+    def _update(self, track: dict, stage: str, done: float, block: dict) -> None:
+        track_no = track["track_no"]
+        with self._lock:
+            self._done[(track_no, stage)] = max(done, 0.0)
+            track_seconds = sum(
+                seconds for (no, _), seconds in self._done.items() if no == track_no
+            )
+            book_seconds = sum(self._done.values())
+        elapsed = time.monotonic() - self.started
+        book_speed = book_seconds / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if book_speed > 0:
+            eta = max(self.book_duration - book_seconds, 0.0) / book_speed
+        total_size = block.get("total_size", "")
+        self.callback(
+            {
+                "track_no": track_no,
+                "title": track["title"],
+                "stage": stage,
+                "track_seconds": track_seconds,
+                "track_duration": self.track_durations[track_no],
+                "book_seconds": book_seconds,
+                "book_duration": self.book_duration,
+                "speed": parse_speed(block.get("speed", "")),
+                "book_speed": book_speed,
+                "total_size": int(total_size) if total_size.isdigit() else 0,
+                "eta": eta,
+            }
+        )
+
+
+def print_progress(event: ProgressEvent) -> None:
+    """Compact one-line progress display for the CLI."""
+    percent = 0.0
+    if event["book_duration"]:
+        percent = event["book_seconds"] / event["book_duration"]
+    line = (
+        f"\r[{event['track_no']}] {event['stage']:<10.10} "
+        f"{format_seconds(event['track_seconds'])}/"
+        f"{format_seconds(event['track_duration'])} | book {percent:6.1%} "
+        f"{event['book_speed']:6.1f}x ETA {format_seconds(event['eta'])}"
+    )
+    print(line, end="", file=sys.stderr, flush=True)
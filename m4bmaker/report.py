@@ -0,0 +1,185 @@
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Iterator
+
+try:  # POSIX only
+    import resource
+except ImportError:
+    resource = None
+
+from m4bmaker.types import ResourceUsage
+
+BOOK = "book"  # track_no of the stages that run once per book, e.g. planning
+# ru_maxrss is in kilobytes, except on macOS where it is in bytes
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def wait_process(process) -> ResourceUsage | None:
+    """Waits for a child process and returns its own cpu time and peak memory.
+
+    Only available where os.wait4 is (POSIX), elsewhere it just waits.
+    """
+    if not hasattr(os, "wait4"):
+        process.wait()
+        return None
+    try:
+        _, status, rusage = os.wait4(process.pid, 0)
+    except ChildProcessError:  # already reaped, e.g. by the poll() of kill()
+        process.wait()
+        return None
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return {
+        "user": rusage.ru_utime,
+        "sys": rusage.ru_stime,
+        "maxrss": rusage.ru_maxrss * RSS_UNIT,
+    }
+
+
+def children_usage() -> ResourceUsage | None:
+    """Cpu time & peak memory of all children of this process so far."""
+    if not resource:
+        return None
+    rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "user": rusage.ru_utime,
+        "sys": rusage.ru_stime,
+        "maxrss": rusage.ru_maxrss * RSS_UNIT,
+    }
+
+
+def _realtime_factor(audio_seconds: float, wall: float) -> float | None:
+    return round(audio_seconds / wall, 2) if wall > 0 else None
+
+
+def _empty_stats() -> dict:
+    return {"runs": 0, "wall": 0.0, "user": 0.0, "sys": 0.0, "maxrss": 0}
+
+
+def _track_order(track_no: str) -> int:
+    # "book" first, then tracks by number, "10/12" after "9/12"
+    return 0 if track_no == BOOK else int(track_no.partition("/")[0])
+
+
+class RunReport:
+    """Wall time, child cpu time and peak memory per track, stage and book.
+
+    Every ffmpeg/ffprobe run and in-process step is recorded as a stage of a track,
+    or of BOOK for steps like planning. Stages can nest, e.g. "temp_files" includes
+    "chapter_data", so their sum can exceed the wall time of a track.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._stages = defaultdict(_empty_stats)
+        self._tracks: dict[str, dict] = {}
+        self._wall = 0.0
+        self._children: ResourceUsage | None = None
+
+    def record(
+        self,
+        track_no: str,
+        stage: str,
+        wall: float,
+        usage: ResourceUsage | None = None,
+    ) -> None:
+        with self._lock:
+            stats = self._stages[(track_no, stage)]
+            stats["runs"] += 1
+            stats["wall"] += wall
+            if usage:
+                stats["user"] += usage["user"]
+                stats["sys"] += usage["sys"]
+                stats["maxrss"] = max(stats["maxrss"], usage["maxrss"])
+
+    @contextmanager
+    def timed(self, track_no: str, stage: str) -> Iterator[None]:
+        """Records the wall time of an in-process step."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(track_no, stage, time.monotonic() - start)
+
+    @contextmanager
+    def track(self, track_no: str, audio_seconds: float) -> Iterator[None]:
+        """Records the wall time of a whole track and the audio it covers."""
+        start, completed = time.monotonic(), False
+        try:
+            yield
+            completed = True
+        finally:
+            with self._lock:
+                self._tracks[track_no] = {
+                    "wall": time.monotonic() - start,
+                    "audio_seconds": audio_seconds,
+                    "completed": completed,
+                }
+
+    @contextmanager
+    def run(self) -> Iterator[None]:
+        """Records the wall time and the child usage of a whole conversion."""
+        start, before = time.monotonic(), children_usage()
+        try:
+            yield
+        finally:
+            self._wall += time.monotonic() - start
+            after = children_usage()
+            if before and after:
+                self._children = {
+                    "user": after["user"] - before["user"],
+                    "sys": after["sys"] - before["sys"],
+                    "maxrss": after["maxrss"],  # peak of any child, not a delta
+                }
+
+    @staticmethod
+    def _rounded(stats: dict) -> dict:
+        return {k: round(v, 3) if isinstance(v, float) else v for k, v in stats.items()}
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            items = [(key, dict(stats)) for key, stats in self._stages.items()]
+            tracks = {no: dict(track) for no, track in self._tracks.items()}
+
+        stages = defaultdict(_empty_stats)
+        per_track = defaultdict(dict)
+        for (track_no, stage), stats in items:
+            per_track[track_no][stage] = self._rounded(stats)
+            total = stages[stage]
+            for key in ("runs", "wall", "user", "sys"):
+                total[key] += stats[key]
+            total["maxrss"] = max(total["maxrss"], stats["maxrss"])
+
+        audio_seconds = sum(
+            track["audio_seconds"] for track in tracks.values() if track["completed"]
+        )
+        usage = self._children or {
+            "user": sum(stats["user"] for stats in stages.values()),
+            "sys": sum(stats["sys"] for stats in stages.values()),
+            "maxrss": max((stats["maxrss"] for stats in stages.values()), default=0),
+        }
+        book = {
+            "wall": self._wall,
+            **usage,
+            "audio_seconds": audio_seconds,
+            "realtime_factor": _realtime_factor(audio_seconds, self._wall),
+        }
+        tracks_report = {}
+        for track_no in sorted(per_track.keys() | tracks.keys(), key=_track_order):
+            track = tracks.get(track_no, {})
+            if track.get("completed"):
+                track["realtime_factor"] = _realtime_factor(
+                    track["audio_seconds"], track["wall"]
+                )
+            tracks_report[track_no] = {
+                **self._rounded(track),
+                "stages": per_track[track_no],
+            }
+        return {
+            "book": self._rounded(book),
+            "stages": {stage: self._rounded(stats) for stage, stats in stages.items()},
+            "tracks": tracks_report,
+        }
@@ -0,0 +1,156 @@
+import json
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name != "posix":  # os.kill would terminate it on Windows, rely on the TTL
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # alive, owned by another user
+        return True
+    return True
+
+
+def _remove(files: list[Path], dirs: list[Path]) -> list[Path]:
+    # removes files, then the dirs that are empty afterwards, returns what was removed
+    removed = []
+    for file in files:
+        try:
+            file.unlink()
+            removed.append(file)
+        except FileNotFoundError:
+            pass
+    for folder in dirs:
+        try:
+            folder.rmdir()
+            removed.append(folder)
+        except OSError:  # gone, or not empty
+            pass
+    return removed
+
+
+@contextmanager
+def interrupt_on_sigterm() -> Iterator[None]:
+    """Turns SIGTERM into KeyboardInterrupt, so cleanup runs as on Ctrl+C.
+
+    Only the main thread can set signal handlers, in other threads it does nothing.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def handler(signum: int, frame) -> None:
+        raise KeyboardInterrupt(f"Received signal {signum}.")
+
+    previous = signal.signal(signal.SIGTERM, handler)
+    try:
+        yield
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+
+
+class TempFiles:
+    """Intermediate files of a run, removed when it ends, however it ends.
+
+    Files are registered before they are written, in memory and in a registry file
+    of the run in registry_dir (one .jsonl per run). A run killed before it could
+    clean up leaves its registry behind, and sweep() removes the files of such runs
+    once they are older than a TTL. With keep, files survive the run for debugging
+    and are left to the sweep.
+    """
+
+    def __init__(self, registry_dir: Path | None = None, keep: bool = False) -> None:
+        self.keep = keep
+        self.registry_dir = Path(registry_dir) if registry_dir else None
+        self.registry: Path | None = None
+        self._lock = threading.Lock()
+        self._files: dict[Path, None] = {}  # ordered set
+        self._dirs: dict[Path, None] = {}
+
+    def _log_entry(self, entry: dict) -> None:
+        # the registry is created by the first entry, so runs without temp files
+        # leave nothing behind
+        if not self.registry_dir:
+            return
+        lines = [entry]
+        if not self.registry:
+            self.registry_dir.mkdir(parents=True, exist_ok=True)
+            self.registry = self.registry_dir / f"{uuid.uuid4().hex}.jsonl"
+            lines.insert(0, {"pid": os.getpid(), "host": socket.gethostname()})
+        with open(self.registry, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(line) + "\n" for line in lines)
+
+    def register(self, *files: Path) -> None:
+        """Registers files that are about to be written."""
+        with self._lock:
+            for file in files:
+                if file not in self._files:
+                    self._files[file] = None
+                    self._log_entry({"file": str(file)})
+
+    def register_dir(self, folder: Path) -> None:
+        """Registers a directory of the run, removed once empty."""
+        with self._lock:
+            if folder not in self._dirs:
+                self._dirs[folder] = None
+                self._log_entry({"dir": str(folder)})
+
+    def cleanup(self, keep: set[Path] = frozenset()) -> list[Path]:
+        """Removes the registered files and returns the ones that existed.
+
+        Files in keep stay, e.g. to resume from, and so does the registry listing
+        them, so they are swept if nothing resumes.
+        """
+        with self._lock:
+            if self.keep:
+                return []
+            files = [file for file in self._files if file not in keep]
+            removed = _remove(files, list(self._dirs))
+            if self.registry and not keep:
+                self.registry.unlink(missing_ok=True)
+            self.registry = None
+            self._files.clear()
+            self._dirs.clear()
+        return removed
+
+    def sweep(self, ttl: float, keep: set[Path] = frozenset()) -> list[Path]:
+        """Removes the files of other runs that ended without cleaning up.
+
+        A registry counts once it's older than ttl seconds and its process, if on
+        this host, is gone. Files in keep are taken over by this run instead, and a
+        registry listing any of them counts at any age.
+        """
+        if not self.registry_dir or not self.registry_dir.is_dir():
+            return []
+        removed, host = [], socket.gethostname()
+        for registry in self.registry_dir.glob("*.jsonl"):
+            if registry == self.registry:
+                continue
+            try:
+                age = time.time() - registry.stat().st_mtime
+                with open(registry, "r", encoding="utf-8") as f:
+                    entries = [json.loads(line) for line in f if line.strip()]
+            except (OSError, json.JSONDecodeError):
+                continue
+            header = entries[0] if entries else {}
+            pid = header.get("pid")
+            if pid and header.get("host") == host and _pid_alive(pid):
+                continue
+            files = [Path(e["file"]) for e in entries if "file" in e]
+            if age < ttl and not keep.intersection(files):
+                continue
+            dirs = [Path(e["dir"]) for e in entries if "dir" in e]
+            removed += _remove([file for file in files if file not in keep], dirs)
+            registry.unlink(missing_ok=True)
+        return removed
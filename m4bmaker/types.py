@@ -1,5 +1,21 @@
+import logging
 from pathlib import Path
-from typing import TypedDict
+from typing import Callable, TypedDict
+
+
+class MediaInfo(TypedDict):
+    duration: float
+    codec: str
+    sample_rate: int
+    channels: int
+    bitrate: int
+    profile: str  # aac: "LC", "HE-AAC", ... as named by ffprobe, else ""
+
+
+class ResourceUsage(TypedDict):
+    user: float  # cpu seconds
+    sys: float
+    maxrss: int  # bytes
 
 
 class ChapterData(TypedDict):
@@ -20,3 +36,30 @@ class TrackData(TypedDict):
     chapters: list[ChapterData]
     temp_files: TempFilesData
     duration: int
+
+
+class ProgressEvent(TypedDict):
+    track_no: str
+    title: str
+    stage: str
+    track_seconds: float
+    track_duration: float
+    book_seconds: float
+    book_duration: float
+    speed: float  # of the current ffmpeg run, x realtime
+    book_speed: float  # audio seconds processed per wall second, whole book
+    total_size: int
+    eta: float | None
+
+
+class FFCommand(TypedDict):
+    cmd: list
+    lg: logging.LoggerAdapter
+    progress: Callable[[dict], None] | None
+    track_no: str
+    stage: str
+    done: Callable[[], None] | None  # run after the command succeeded
+    output: Path
+    partial: Path  # written by ffmpeg, renamed to output once complete
+    checkpoint: str | None  # journal key, for intermediate outputs only
+    fallback: list | None  # run instead if the reserved moov was too small
@@ -0,0 +1,310 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+
+from m4bmaker.batch import CONFIG_NAME, convert_book
+from m4bmaker.cache import ProbeCache, default_cache_dir
+from m4bmaker.logger import logger_factory
+from m4bmaker.m4bmaker import M4BMaker
+
+COVER_TYPES = [".jpg", ".jpeg", ".png"]
+
+
+def folder_signature(folder: Path) -> tuple[int, int, int]:
+    """Returns (files, total size, latest mtime_ns) of a book folder.
+
+    The output directory of the book is left out, so converting it doesn't count
+    as a change.
+    """
+    count = size = latest = 0
+    for root, dirs, files in os.walk(folder):
+        if Path(root) == folder and M4BMaker.OUTPUT_DIR in dirs:
+            dirs.remove(M4BMaker.OUTPUT_DIR)
+        for name in files:
+            stat = os.stat(os.path.join(root, name))
+            count += 1
+            size += stat.st_size
+            latest = max(latest, stat.st_mtime_ns)
+    return count, size, latest
+
+
+class JobQueue:
+    """Persistent queue of watch-folder jobs, one row per book folder.
+
+    A folder is queued again only when its signature changes, so finished and failed
+    books aren't converted twice. A change while the folder converts is kept in
+    requeue and queued once that job finishes. Jobs left running by a crash are
+    queued again by recover().
+    """
+
+    def __init__(self, cache_dir: Path) -> None:
+        self.path = Path(cache_dir) / "watch_queue.sqlite"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (folder TEXT PRIMARY KEY, "
+                "signature TEXT, mode TEXT, config TEXT, status TEXT, attempts INT, "
+                "error TEXT, updated REAL, requeue TEXT DEFAULT '')"
+            )
+            # queues of older versions lack the requeue column
+            columns = self._db.execute("PRAGMA table_info(jobs)").fetchall()
+            if "requeue" not in [column["name"] for column in columns]:
+                self._db.execute("ALTER TABLE jobs ADD COLUMN requeue TEXT DEFAULT ''")
+
+    def __enter__(self) -> "JobQueue":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def recover(self) -> int:
+        with self._lock, self._db:
+            rows = self._db.execute(
+                "SELECT folder, requeue FROM jobs WHERE status = 'running'"
+            ).fetchall()
+            for row in rows:
+                self._release(row["folder"], row["requeue"], "pending", "")
+        return len(rows)
+
+    def enqueue(self, folder: Path, signature: str, mode: str, config: Path) -> bool:
+        """Queues a folder, unless it was already queued with the same signature.
+
+        A running folder isn't touched, the new signature is queued when it finishes.
+        """
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT signature, status, requeue FROM jobs WHERE folder = ?",
+                (str(folder),),
+            ).fetchone()
+            if row and row["status"] == "running":
+                requeue = json.dumps([signature, mode, str(config)])
+                if signature == row["signature"] or requeue == row["requeue"]:
+                    return False
+                self._db.execute(
+                    "UPDATE jobs SET requeue = ? WHERE folder = ?",
+                    (requeue, str(folder)),
+                )
+                return True
+            if row and row["signature"] == signature:
+                return False
+            self._db.execute(
+                "INSERT OR REPLACE INTO jobs "
+                "VALUES (?, ?, ?, ?, 'pending', 0, '', ?, '')",
+                (str(folder), signature, mode, str(config), time.time()),
+            )
+        return True
+
+    def claim(self) -> dict | None:
+        """Marks the oldest pending job as running and returns it, with its attempt."""
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT * FROM jobs WHERE status = 'pending' ORDER BY updated LIMIT 1"
+            ).fetchone()
+            if not row:
+                return None
+            self._db.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, "
+                "updated = ? WHERE folder = ?",
+                (time.time(), row["folder"]),
+            )
+        return dict(row) | {"status": "running", "attempts": row["attempts"] + 1}
+
+    def finish(self, job: dict, error: str | None = None) -> None:
+        """Records the result of a claimed job, then queues a change seen meanwhile."""
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT requeue FROM jobs WHERE folder = ? AND signature = ? "
+                "AND attempts = ? AND status = 'running'",
+                (job["folder"], job["signature"], job["attempts"]),
+            ).fetchone()
+            if row:  # else it was replaced, e.g. by recover() of another watcher
+                status = "failed" if error else "done"
+                self._release(job["folder"], row["requeue"], status, error or "")
+
+    def _release(self, folder: str, requeue: str, status: str, error: str) -> None:
+        # ends the running state of a job, which is queued again if it changed since
+        if requeue:
+            signature, mode, config = json.loads(requeue)
+            self._db.execute(
+                "UPDATE jobs SET signature = ?, mode = ?, config = ?, "
+                "status = 'pending', attempts = 0, error = '', updated = ?, "
+                "requeue = '' WHERE folder = ?",
+                (signature, mode, config, time.time(), folder),
+            )
+        else:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated = ? WHERE folder = ?",
+                (status, error, time.time(), folder),
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall()
+        return {"path": str(self.path), **{status: count for status, count in rows}}
+
+
+class Watcher:
+    """Polls a drop folder and converts every book folder that stopped changing.
+
+    A folder is settled once its newest file is `settle` seconds old and its
+    signature didn't change since the previous scan. Folders with an m4bmaker.json
+    become json jobs, the others get a generated config and `mode` (single or
+    chapter). Up to `workers` books convert at once, sharing `slots` ff processes, the
+    probe cache and the ffmpeg lookup.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        log_dir: Path,
+        cache_dir: Path | None = None,
+        mode: str = "single",
+        interval: float = 5.0,
+        settle: float = 30.0,
+        workers: int = 1,
+        slots: int | None = None,
+        probe_cache: bool = True,
+        **options,
+    ) -> None:
+        self.root = Path(root).resolve()
+        self.log_dir = Path(log_dir)
+        self.cache_dir = Path(cache_dir or default_cache_dir())
+        self.mode = "single" if mode == "json" else mode
+        self.interval = interval
+        self.settle = settle
+        self.workers = workers
+        self.options = options | {"cache_dir": self.cache_dir}
+        self.slots = threading.BoundedSemaphore(slots or os.cpu_count() or 1)
+        self.probe_cache = ProbeCache(self.cache_dir) if probe_cache else False
+        self.queue = JobQueue(self.cache_dir)
+        self.config_dir = self.cache_dir / "watch_configs"
+        self.config_dir.mkdir(parents=True, exist_ok=True)
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.lg = logger_factory(
+            name=f"{__name__}.watcher",
+            log_path=self.log_dir / "watch.log",
+            file_mode="a",
+        )
+        self._signatures: dict[Path, tuple[int, int, int]] = {}
+        self._stop = threading.Event()
+
+    def stop(self) -> None:
+        """Stops scanning, the running jobs are finished first."""
+        self._stop.set()
+
+    def _job_config(self, folder: Path) -> tuple[str, Path]:
+        if (config := folder / CONFIG_NAME).is_file():
+            return M4BMaker.MODES.json.name, config
+        covers = sorted(
+            p.name for p in folder.iterdir() if p.suffix.lower() in COVER_TYPES
+        )
+        name = hashlib.sha256(str(folder).encode("utf-8")).hexdigest()[:16]
+        config = self.config_dir / f"{name}.json"
+        data = {
+            "path": str(folder),
+            "title": folder.name,
+            "cover": covers[0] if covers else "",
+            "tracks": [],
+        }
+        config.write_text(json.dumps(data, indent=2), encoding="utf-8")
+        return self.mode, config
+
+    def scan(self, once: bool = False) -> int:
+        """Queues the settled book folders and returns how many were queued.
+
+        With once, there's no previous scan to compare, so only the age counts.
+        """
+        queued, now = 0, time.time_ns()
+        for folder in sorted(p for p in self.root.iterdir() if p.is_dir()):
+            try:
+                queued += self._scan_folder(folder, now, once)
+            except OSError as exc:  # e.g. an upload renamed a file, still changing
+                self.lg.debug(f"Can't scan {folder}, skipping it for now: {exc}")
+                self._signatures.pop(folder, None)
+        return queued
+
+    def _scan_folder(self, folder: Path, now: int, once: bool) -> bool:
+        signature = folder_signature(folder)
+        previous = self._signatures.get(folder)
+        self._signatures[folder] = signature
+        count, _, latest = signature
+        if not count or now - latest < self.settle * 1e9:
+            return False
+        if not once and previous != signature:
+            return False
+        has_audio = any(
+            p.suffix.lower() in M4BMaker.INPUT_TYPES for p in folder.iterdir()
+        )
+        if not has_audio and not (folder / CONFIG_NAME).is_file():
+            return False
+        mode, config = self._job_config(folder)
+        if not self.queue.enqueue(folder, json.dumps(signature), mode, config):
+            return False
+        self.lg.info(f"Queued {mode} job: {folder}")
+        return True
+
+    def _run_job(self, job: dict) -> None:
+        folder = Path(job["folder"])
+        name = re.sub(r"[^\w.-]+", "_", folder.name)
+        log_name = f"{name}-{datetime.now():%Y%m%d-%H%M%S}"
+        self.lg.info(f"Converting {folder} (attempt {job['attempts']}).")
+        result = convert_book(
+            Path(job["config"]),
+            self.log_dir / f"{log_name}.log",
+            f"{__name__}.{log_name}",
+            mode=job["mode"],
+            slots=self.slots,
+            probe_cache=self.probe_cache,
+            **self.options,
+        )
+        self.queue.finish(job, result.get("error"))
+        if result["ok"]:
+            self.lg.info(f"Converted {folder}: {result}")
+        else:
+            self.lg.error(f"Failed {folder}: {result['error']}")
+
+    def run(self, once: bool = False) -> None:
+        """Scans and converts until stop(), or until the queue is empty with once."""
+        if recovered := self.queue.recover():
+            self.lg.info(f"Requeued {recovered} job(s) interrupted by a restart.")
+        self.lg.info(
+            f"Watching {self.root}: every {self.interval}s, settle {self.settle}s, "
+            f"{self.workers} book(s) at once."
+        )
+        running = set()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            try:
+                self.scan(once)
+                while not self._stop.is_set():
+                    while len(running) < self.workers and (job := self.queue.claim()):
+                        running.add(pool.submit(self._run_job, job))
+                    if once and not running:
+                        break
+                    if running:
+                        _, running = wait(
+                            running, timeout=self.interval, return_when=FIRST_COMPLETED
+                        )
+                    else:
+                        self._stop.wait(self.interval)
+                    if not once:
+                        self.scan()
+            except KeyboardInterrupt:
+                self.lg.info(f"Interrupted, finishing {len(running)} running job(s).")
+            wait(running)
+        self.lg.info(f"Stopped watching {self.root}: {self.queue.stats()}")
@@ -0,0 +1,179 @@
+"""Builds small synthetic .mp3 and .m4a files, byte by byte, for the parser tests."""
+
+import struct
+
+# MPEG-1 layer III, no CRC, 128 kbps, 44100 Hz: 417 bytes per frame
+MP3_HEADER = b"\xff\xfb\x90"
+MP3_FRAME_LENGTH = 417
+MP3_FRAME_SAMPLES = 1152
+
+
+def box(kind: bytes, *parts: bytes) -> bytes:
+    payload = b"".join(parts)
+    return struct.pack(">I4s", 8 + len(payload), kind) + payload
+
+
+def full_box(kind: bytes, *parts: bytes, version: int = 0, flags: int = 0) -> bytes:
+    return box(kind, struct.pack(">I", version << 24 | flags), *parts)
+
+
+def id3v2(size: int) -> bytes:
+    # syncsafe size, 7 bits per byte
+    syncsafe = bytes((size >> shift) & 0x7F for shift in (21, 14, 7, 0))
+    return b"ID3\x04\x00\x00" + syncsafe + b"\x00" * size
+
+
+def mp3_frame(mono: bool = False, body: bytes = b"") -> bytes:
+    header = MP3_HEADER + (b"\xc0" if mono else b"\x00")
+    return (header + body).ljust(MP3_FRAME_LENGTH, b"\x00")
+
+
+def xing_frame(
+    frames: int, audio_bytes: int, delay: int = 0, padding: int = 0, tag=b"Xing"
+) -> bytes:
+    # the tag follows the 32 bytes of side information of a stereo MPEG-1 frame
+    body = b"\x00" * 32 + tag + struct.pack(">III", 0x3, frames, audio_bytes)
+    if delay or padding:
+        body += b"LAME3.100" + b"\x00" * 12 + (delay << 12 | padding).to_bytes(3, "big")
+    return mp3_frame(body=body)
+
+
+def vbri_frame(frames: int, audio_bytes: int) -> bytes:
+    # VBRI sits 32 bytes after the header, its byte & frame counts 10 bytes later
+    body = b"\x00" * 32 + b"VBRI" + b"\x00" * 6
+    body += struct.pack(">II", audio_bytes, frames)
+    return mp3_frame(body=body)
+
+
+def descriptor(tag: int, payload: bytes) -> bytes:
+    # lengths written with the 4-byte form, like most muxers do
+    size = len(payload)
+    length = bytes(0x80 | (size >> shift) & 0x7F for shift in (21, 14, 7)) + bytes(
+        [size & 0x7F]
+    )
+    return bytes([tag]) + length + payload
+
+
+def esds(object_type: int = 0x40, avg_bitrate: int = 0, config: bytes = b"") -> bytes:
+    decoder_config = bytes([object_type, 0x15]) + b"\x00" * 3
+    decoder_config += struct.pack(">II", avg_bitrate, avg_bitrate)
+    if config:
+        decoder_config += descriptor(0x05, config)
+    es = b"\x00\x01\x00" + descriptor(0x04, decoder_config) + descriptor(0x06, b"\x02")
+    return full_box(b"esds", descriptor(0x03, es))
+
+
+def audio_specific_config(object_type: int, rate_index: int = 4) -> bytes:
+    # audioObjectType (5 bits, 31 escapes to 6 more), rate index & stereo channels
+    if object_type >= 32:
+        bits, width = (31 << 6 | object_type - 32), 11
+    else:
+        bits, width = object_type, 5
+    bits = (bits << 4 | rate_index) << 4 | 2
+    width += 8
+    bits <<= -width % 8
+    return bits.to_bytes((width + 7) // 8, "big")
+
+
+def mp4a(*children: bytes, sample_rate: int = 44100, channels: int = 2) -> bytes:
+    entry = b"\x00" * 6 + struct.pack(">H", 1) + b"\x00" * 8
+    entry += struct.pack(">HHHHI", channels, 16, 0, 0, sample_rate << 16)
+    return box(b"mp4a", entry, *children)
+
+
+def elst(*entries: tuple[int, int], version: int = 0) -> bytes:
+    entry_format = ">QqI" if version else ">IiI"
+    body = struct.pack(">I", len(entries))
+    for segment, media_time in entries:
+        body += struct.pack(entry_format, segment, media_time, 0x10000)
+    return box(b"edts", full_box(b"elst", body, version=version))
+
+
+def stts(*runs: tuple[int, int]) -> bytes:
+    entries = b"".join(struct.pack(">II", *run) for run in runs)
+    return full_box(b"stts", struct.pack(">I", len(runs)), entries)
+
+
+def stsc(*runs: tuple[int, int]) -> bytes:
+    # (first chunk, samples per chunk), sample description 1
+    return full_box(
+        b"stsc",
+        struct.pack(">I", len(runs)),
+        *(struct.pack(">III", first, per_chunk, 1) for first, per_chunk in runs),
+    )
+
+
+def stsz(sizes: list[int], constant: int = 0) -> bytes:
+    if constant:
+        return full_box(b"stsz", struct.pack(">II", constant, len(sizes)))
+    entries = struct.pack(f">{len(sizes)}I", *sizes)
+    return full_box(b"stsz", struct.pack(">II", 0, len(sizes)), entries)
+
+
+def chunk_offsets(offsets: list[int], large: bool = False) -> bytes:
+    kind, item = (b"co64", "Q") if large else (b"stco", "I")
+    entries = struct.pack(f">{len(offsets)}{item}", *offsets)
+    return full_box(kind, struct.pack(">I", len(offsets)), entries)
+
+
+def sound_trak(
+    stbl: list[bytes],
+    timescale: int = 44100,
+    length: int = 0,
+    sample_entry: bytes | None = None,
+    edits: bytes = b"",
+    track: int = 1,
+) -> bytes:
+    sample_entry = sample_entry if sample_entry is not None else mp4a()
+    stsd = full_box(b"stsd", struct.pack(">I", 1 if sample_entry else 0), sample_entry)
+    return box(
+        b"trak",
+        full_box(b"tkhd", struct.pack(">III", 0, 0, track), b"\x00" * 72),
+        edits,
+        box(
+            b"mdia",
+            full_box(b"mdhd", struct.pack(">IIIIHH", 0, 0, timescale, length, 0, 0)),
+            full_box(b"hdlr", struct.pack(">I4s", 0, b"soun"), b"\x00" * 13),
+            box(b"minf", box(b"stbl", stsd, *stbl)),
+        ),
+    )
+
+
+def moov(*children: bytes, movie_timescale: int = 1000, duration: int = 0) -> bytes:
+    mvhd = full_box(
+        b"mvhd", struct.pack(">IIII", 0, 0, movie_timescale, duration), b"\x00" * 80
+    )
+    return box(b"moov", mvhd, *children)
+
+
+def mvex(track: int, default_duration: int) -> bytes:
+    trex = full_box(b"trex", struct.pack(">IIIII", track, 1, default_duration, 0, 0))
+    return box(b"mvex", trex)
+
+
+def ftyp() -> bytes:
+    return box(b"ftyp", b"M4A \x00\x00\x00\x00", b"M4A mp42isom")
+
+
+def fragment(
+    track: int, durations: list[int] | None = None, count: int = 0, default: int = 0
+) -> bytes:
+    # a moof with one traf: per sample durations, or count samples of the default
+    tfhd_flags = 0x08 if default else 0
+    tfhd = full_box(
+        b"tfhd",
+        struct.pack(">I", track),
+        struct.pack(">I", default) if default else b"",
+        flags=tfhd_flags,
+    )
+    if durations is not None:
+        trun = full_box(
+            b"trun",
+            struct.pack(">I", len(durations)),
+            *(struct.pack(">I", duration) for duration in durations),
+            flags=0x100,
+        )
+    else:
+        trun = full_box(b"trun", struct.pack(">I", count))
+    mfhd = full_box(b"mfhd", struct.pack(">I", 1))
+    return box(b"moof", mfhd, box(b"traf", tfhd, trun))
@@ -0,0 +1,155 @@
+import pytest
+
+from m4bmaker import inspector
+from tests.media import (
+    MP3_FRAME_LENGTH,
+    MP3_FRAME_SAMPLES,
+    audio_specific_config,
+    box,
+    elst,
+    esds,
+    ftyp,
+    id3v2,
+    moov,
+    mp3_frame,
+    mp4a,
+    sound_trak,
+    vbri_frame,
+    xing_frame,
+)
+
+
+def write(tmp_path, name: str, data: bytes):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return path
+
+
+def test_cbr_mp3_duration_from_the_audio_size(tmp_path):
+    frames = 100
+    data = id3v2(300) + mp3_frame() * frames + b"TAG" + b"\x00" * 125
+    info = inspector.inspect(write(tmp_path, "cbr.mp3", data))
+    assert info == {
+        "duration": pytest.approx(frames * MP3_FRAME_LENGTH * 8 / 128000),
+        "codec": "mp3",
+        "sample_rate": 44100,
+        "channels": 2,
+        "bitrate": 128000,
+        "profile": "",
+    }
+
+
+def test_mp3_sync_skips_false_frame_headers(tmp_path):
+    # a lone sync word isn't followed by a matching frame, so it's skipped
+    data = b"\xff\xfb\x90\x00" + b"\x00" * 10 + mp3_frame(mono=True) * 10
+    info = inspector.inspect(write(tmp_path, "sync.mp3", data))
+    assert info["channels"] == 1
+    assert info["duration"] == pytest.approx(10 * MP3_FRAME_LENGTH * 8 / 128000)
+
+
+def test_xing_mp3_duration_without_the_lame_delay_and_padding(tmp_path):
+    frames, delay, padding = 50, 576, 1000
+    audio_bytes = frames * MP3_FRAME_LENGTH
+    data = xing_frame(frames, audio_bytes, delay, padding) + mp3_frame() * frames
+    info = inspector.inspect(write(tmp_path, "xing.mp3", data))
+    duration = (frames * MP3_FRAME_SAMPLES - delay - padding) / 44100
+    assert info["duration"] == pytest.approx(duration)
+    assert info["bitrate"] == round(audio_bytes * 8 / duration)
+
+
+def test_info_tag_without_lame_counts_every_frame(tmp_path):
+    frames = 20
+    data = xing_frame(frames, frames * MP3_FRAME_LENGTH, tag=b"Info")
+    data += mp3_frame() * frames
+    info = inspector.inspect(write(tmp_path, "info.mp3", data))
+    assert info["duration"] == pytest.approx(frames * MP3_FRAME_SAMPLES / 44100)
+
+
+def test_vbri_mp3_duration_from_its_frame_count(tmp_path):
+    frames = 30
+    data = vbri_frame(frames, frames * MP3_FRAME_LENGTH) + mp3_frame() * frames
+    info = inspector.inspect(write(tmp_path, "vbri.mp3", data))
+    assert info["duration"] == pytest.approx(frames * MP3_FRAME_SAMPLES / 44100)
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"",
+        b"ID3\x04\x00",  # truncated ID3v2 header
+        id3v2(10) + b"\x00" * 1000,  # no frames
+    ],
+)
+def test_unparseable_mp3_is_left_to_ffprobe(tmp_path, data):
+    assert inspector.inspect(write(tmp_path, "bad.mp3", data)) is None
+
+
+@pytest.mark.parametrize(
+    "object_type, expected",
+    [(2, 2), (5, 5), (29, 29), (42, 42)],  # LC, HE-AAC, HE-AACv2, escaped USAC
+)
+def test_esds_audio_object_type(object_type, expected):
+    data = esds(0x40, 96000, audio_specific_config(object_type))
+    assert inspector._parse_esds(data, 8, len(data)) == (0x40, 96000, expected)
+
+
+def test_esds_without_decoder_specific_info():
+    data = esds(0x6B, 128000)
+    assert inspector._parse_esds(data, 8, len(data)) == (0x6B, 128000, 0)
+
+
+def m4a(tmp_path, entry: bytes, edits: bytes = b"", mdat: bytes = b"") -> dict | None:
+    length = 100 * 1024
+    trak = sound_trak([], 44100, length, entry, edits)
+    data = ftyp() + moov(trak) + (box(b"mdat", mdat) if mdat else b"")
+    return inspector.inspect(write(tmp_path, "in.m4a", data))
+
+
+def test_m4a_profile_and_bitrate_from_esds(tmp_path):
+    entry = mp4a(esds(0x40, 64000, audio_specific_config(5)))
+    info = m4a(tmp_path, entry)
+    assert info == {
+        "duration": pytest.approx(100 * 1024 / 44100),
+        "codec": "aac",
+        "sample_rate": 44100,
+        "channels": 2,
+        "bitrate": 64000,
+        "profile": "HE-AAC",
+    }
+
+
+def test_m4a_duration_after_the_edit_list(tmp_path):
+    # an empty edit, then 2292 ms in the movie timescale after 1024 priming samples
+    entry = mp4a(esds(0x40, 64000, audio_specific_config(2)))
+    info = m4a(tmp_path, entry, elst((0, -1), (2292, 1024)))
+    assert info["duration"] == pytest.approx(2.292)
+    assert info["profile"] == "LC"
+
+
+def test_m4a_bitrate_from_the_mdat_without_esds_bitrate(tmp_path):
+    entry = mp4a(esds(0x40, 0, audio_specific_config(2)))
+    info = m4a(tmp_path, entry, mdat=b"\x00" * 8000)
+    assert info["bitrate"] == round(8000 * 8 / (100 * 1024 / 44100))
+
+
+def test_m4a_other_codecs_have_no_profile(tmp_path):
+    info = m4a(tmp_path, box(b"alac", b"\x00" * 28))
+    assert info["codec"] == "alac"
+    assert info["profile"] == ""
+
+
+@pytest.mark.parametrize(
+    "entry",
+    [
+        b"",  # stsd without entries
+        mp4a(esds(0x20)),  # mpeg-4 video object type
+        box(b"mp4v", b"\x00" * 28),
+    ],
+)
+def test_unparseable_m4a_is_left_to_ffprobe(tmp_path, entry):
+    assert m4a(tmp_path, entry) is None
+
+
+def test_truncated_m4a_is_left_to_ffprobe(tmp_path):
+    data = ftyp() + moov(sound_trak([], 44100, 1024))
+    assert inspector.inspect(write(tmp_path, "cut.m4a", data[:-20])) is None
@@ -0,0 +1,231 @@
+import struct
+
+import pytest
+
+from m4bmaker import mp4
+from tests.media import (
+    box,
+    chunk_offsets,
+    elst,
+    fragment,
+    ftyp,
+    full_box,
+    moov,
+    mvex,
+    sound_trak,
+    stsc,
+    stsz,
+    stts,
+)
+
+
+def write(tmp_path, data: bytes):
+    path = tmp_path / "out.m4b"
+    path.write_bytes(data)
+    return path
+
+
+def chpl(*chapters: tuple[float, str]) -> bytes:
+    entries = b"".join(
+        struct.pack(">QB", round(start * 10_000_000), len(title.encode()))
+        + title.encode()
+        for start, title in chapters
+    )
+    return full_box(b"chpl", b"\x00" * 4, bytes([len(chapters)]), entries, version=1)
+
+
+def ilst(tags: dict[bytes, bytes]) -> bytes:
+    items = [
+        box(kind, box(b"data", struct.pack(">II", 1, 0), value))
+        for kind, value in tags.items()
+    ]
+    hdlr = full_box(b"hdlr", struct.pack(">I4s", 0, b"mdir"), b"\x00" * 13)
+    return box(b"meta", b"\x00" * 4, hdlr, box(b"ilst", *items))
+
+
+def text_trak(titles: list[str], first_offset: int) -> tuple[bytes, bytes]:
+    # QuickTime chapter track, one sample per title, and the mdat holding them
+    samples = [struct.pack(">H", len(t)) + t.encode() for t in titles]
+    offsets, offset = [], first_offset
+    for sample in samples:
+        offsets.append(offset)
+        offset += len(sample)
+    stbl = [
+        stts((len(titles), 5000)),
+        stsc((1, 1)),
+        stsz([len(sample) for sample in samples]),
+        chunk_offsets(offsets),
+    ]
+    trak = sound_trak(stbl, 1000, len(titles) * 5000, track=2)
+    return trak.replace(b"soun", b"text"), b"".join(samples)
+
+
+@pytest.mark.parametrize("version", [0, 1])
+def test_duration_after_the_edit_list(tmp_path, version):
+    # 44100 Hz, priming of 1024 samples, 9977 ms in the movie timescale
+    edits = elst((9977, 1024), version=version)
+    data = ftyp() + moov(sound_trak([], 44100, 441000, edits=edits))
+    info = mp4.read_structure(write(tmp_path, data))
+    assert info["duration"] == pytest.approx(9.977)
+    assert info["boxes"] == ["ftyp", "moov"]
+    assert not info["fragmented"]
+
+
+def test_duration_without_an_edit_list_is_the_media_duration(tmp_path):
+    data = ftyp() + moov(sound_trak([], 48000, 480000))
+    assert mp4.read_structure(write(tmp_path, data))["duration"] == pytest.approx(10)
+
+
+def test_edit_without_segment_duration_plays_the_rest_of_the_media(tmp_path):
+    edits = elst((0, -1), (0, 2048))  # empty edit, then from the priming on
+    data = ftyp() + moov(sound_trak([], 44100, 44100 + 2048, edits=edits))
+    assert mp4.read_structure(write(tmp_path, data))["duration"] == pytest.approx(1)
+
+
+def test_fragmented_duration_from_trun_and_the_defaults(tmp_path):
+    data = ftyp() + moov(sound_trak([], 44100, 0), mvex(1, 1024))
+    data += fragment(1, durations=[1024] * 10)  # per sample durations
+    data += fragment(1, count=5, default=2048)  # default of the tfhd
+    data += fragment(1, count=4)  # default of the trex
+    data += fragment(2, count=100, default=1024)  # another track
+    info = mp4.read_structure(write(tmp_path, data))
+    assert info["fragmented"]
+    assert info["duration"] == pytest.approx((10 * 1024 + 5 * 2048 + 4 * 1024) / 44100)
+
+
+def test_fragments_are_placed_on_the_track_timeline(tmp_path):
+    head = ftyp() + moov(sound_trak([], 44100, 0), mvex(1, 1024))
+    first, second = fragment(1, count=3), fragment(1, durations=[512, 512])
+    buf = head + first + second
+    runs = mp4.fragments(buf, len(buf), (len(ftyp()) + 8, len(head)), 1)
+    assert runs == [
+        (len(head), 0, 3 * 1024),
+        (len(head) + len(first), 3 * 1024, 1024),
+    ]
+
+
+def test_chapters_tags_and_cover(tmp_path):
+    udta = box(
+        b"udta",
+        chpl((0, "One"), (12.5, "Two")),
+        ilst(
+            {
+                b"\xa9nam": b"Track",
+                b"trkn": b"\x00\x00\x00\x02\x00\x05",
+                b"covr": b"\xff\xd8\xff",
+            }
+        ),
+    )
+    data = ftyp() + moov(sound_trak([], 44100, 44100), udta)
+    info = mp4.read_structure(write(tmp_path, data))
+    assert info["chapters"] == [(0, "One"), (12.5, "Two")]
+    assert info["tags"] == {"title": "Track", "track": "2/5"}
+    assert info["cover"]
+
+
+def test_chapters_from_a_text_track(tmp_path):
+    titles = ["Intro", "Chapter 1", "Chapter 2"]
+    audio = sound_trak([], 44100, 44100)
+    head = ftyp() + moov(audio, text_trak(titles, 0)[0])  # same size at any offset
+    trak, samples = text_trak(titles, len(head) + 8)
+    data = ftyp() + moov(audio, trak) + box(b"mdat", samples)
+    info = mp4.read_structure(write(tmp_path, data))
+    assert info["chapters"] == [(0, "Intro"), (5, "Chapter 1"), (10, "Chapter 2")]
+    assert info["boxes"] == ["ftyp", "moov", "mdat"]
+
+
+def test_corrupt_box_size_raises(tmp_path):
+    data = ftyp() + struct.pack(">I4s", 1000, b"moov")
+    with pytest.raises(ValueError):
+        mp4.read_structure(write(tmp_path, data))
+
+
+def test_decoded_samples_count_whole_frames_less_the_priming(tmp_path):
+    edits = elst((2000, 2112))  # the edit hides the padding, the decoder doesn't
+    trak = sound_trak([stsz([300] * 90)], 44100, 90 * 1024, edits=edits)
+    data = ftyp() + moov(trak)
+    assert mp4.decoded_samples(write(tmp_path, data), 1024) == (44100, 90 * 1024 - 2112)
+
+
+def test_decoded_samples_of_fragments(tmp_path):
+    data = ftyp() + moov(sound_trak([stsz([])], 44100, 0, edits=elst((0, 1024))))
+    data += fragment(1, count=20, default=1024) + fragment(2, count=7, default=1024)
+    assert mp4.decoded_samples(write(tmp_path, data), 1024) == (44100, 19 * 1024)
+
+
+def sample_table(large: bool = False) -> bytes:
+    # 20 samples of varied sizes: two stts runs, three stsc runs over six chunks
+    sizes = [100 + i * 7 for i in range(20)]
+    base = 2**33 if large else 1000
+    offsets = [base + chunk * 10_000 for chunk in range(6)]
+    return box(
+        b"stbl",
+        stts((12, 1024), (8, 512)),
+        stsc((1, 3), (3, 5), (5, 2)),
+        stsz(sizes),
+        chunk_offsets(offsets, large),
+    )
+
+
+@pytest.mark.parametrize("large", [False, True])
+def test_sample_ranges_follow_the_chunk_runs(large):
+    buf = sample_table(large)
+    ranges = mp4.sample_ranges(buf, (8, len(buf)))
+    base = 2**33 if large else 1000
+    # the first sample of every chunk sits at the chunk offset
+    firsts = [0, 3, 6, 11, 16, 18]
+    assert [ranges[i][0] for i in firsts] == [base + c * 10_000 for c in range(6)]
+    # and the others follow the previous sample of the chunk
+    assert ranges[4] == (ranges[3][0] + ranges[3][1], 100 + 4 * 7)
+    assert ranges[15] == (ranges[14][0] + ranges[14][1], 100 + 15 * 7)
+    assert len(ranges) == 20
+
+
+@pytest.mark.parametrize("large", [False, True])
+def test_seek_points_match_the_expanded_tables(large):
+    buf = sample_table(large)
+    stbl = (8, len(buf))
+    times, ranges = mp4.sample_times(buf, stbl), mp4.sample_ranges(buf, stbl)
+    targets = list(range(0, times[-1] + 2000, 97))
+    expected = []
+    for target in targets:
+        sample = max(i for i, time in enumerate(times) if time <= target)
+        expected.append((times[sample], ranges[sample][0]))
+    assert mp4.seek_points(buf, stbl, targets) == expected
+
+
+def test_seek_index_of_a_fragmented_file(tmp_path):
+    head = ftyp() + moov(sound_trak([], 44100, 0), mvex(1, 1024))
+    moof = fragment(1, count=43)  # 43 frames, about a second
+    data = head + moof * 4 + box(b"mdat", b"\x00" * 100)
+    index = mp4.seek_index(write(tmp_path, data), 1.0)
+    fragment_seconds = 43 * 1024 / 44100
+    assert index["fragmented"]
+    assert index["moov"] == [len(ftyp()), len(head) - len(ftyp())]
+    assert index["points"] == [
+        [round(int(t // fragment_seconds) * fragment_seconds, 3),
+         len(head) + int(t // fragment_seconds) * len(moof)]
+        for t in range(4)
+    ]  # fmt: skip
+
+
+def test_seek_index_maps_chapters_to_their_frames(tmp_path):
+    frames = 100  # 10 per chunk, 200 bytes each, chunks 3000 bytes apart
+    offsets = [10_000 + chunk * 3000 for chunk in range(10)]
+    stbl = [
+        stts((frames, 1024)),
+        stsc((1, 10)),
+        stsz([200] * frames),
+        chunk_offsets(offsets),
+    ]
+    udta = box(b"udta", chpl((0, "One"), (1.0, "Two")))
+    data = ftyp() + moov(sound_trak(stbl, 44100, frames * 1024), udta)
+    index = mp4.seek_index(write(tmp_path, data.ljust(40_000, b"\x00")), 0.5)
+    two = 44100 // 1024  # frame playing at 1 s
+    assert index["chapters"] == [
+        ["One", 0, 0.0, 10_000],
+        ["Two", 1.0, round(two * 1024 / 44100, 3), offsets[two // 10] + two % 10 * 200],
+    ]
+    assert [point[0] for point in index["points"]] == [
+        round((t * 44100 // 1024) * 1024 / 44100, 3) for t in (0, 0.5, 1.0, 1.5, 2.0)
+    ]